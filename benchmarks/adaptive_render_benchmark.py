@@ -0,0 +1,95 @@
+import argparse
+import difflib
+import os
+import sys
+import time
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ocr import RENDER_PRESETS, enhance_image_for_ocr, get_ocr_backend, image_from_samples, plan_page_render, render_page_for_ocr
+
+SAMPLE_LINES = [
+    "The quick brown fox jumps over the lazy dog.",
+    "Pack my box with five dozen liquor jugs 0123456789.",
+    "Sphinx of black quartz, judge my vow!",
+    "How vexingly quick daft zebras jump.",
+]
+FONT_SIZES = [8, 10, 12, 16, 24]
+
+
+def build_ground_truth_pdf(num_pages, scan_dpi):
+    doc = fitz.open()
+    ground_truth = []
+    for page_index in range(num_pages):
+        font_size = FONT_SIZES[page_index % len(FONT_SIZES)]
+        text_doc = fitz.open()
+        text_page = text_doc.new_page()
+        lines = []
+        y = 90
+        while y < text_page.rect.height - 90:
+            line = SAMPLE_LINES[len(lines) % len(SAMPLE_LINES)]
+            text_page.insert_text((90, y), line, fontsize=font_size)
+            lines.append(line)
+            y += font_size * 1.6
+        scan = text_page.get_pixmap(dpi=scan_dpi, colorspace=fitz.csGRAY)
+        text_doc.close()
+
+        scanned_page = doc.new_page()
+        scanned_page.insert_image(scanned_page.rect, pixmap=scan)
+        ground_truth.append("\n".join(lines))
+    return doc, ground_truth
+
+
+def character_accuracy(expected, actual):
+    expected = " ".join(expected.split())
+    actual = " ".join(actual.split())
+    if not expected:
+        return 1.0 if not actual else 0.0
+    matcher = difflib.SequenceMatcher(None, expected, actual, autojunk=False)
+    return sum(block.size for block in matcher.get_matching_blocks()) / len(expected)
+
+
+def run_preset(preset_name, doc, ground_truth, backend, language):
+    start = time.perf_counter()
+    accuracies = []
+    pixels = 0
+    for page, expected in zip(doc, ground_truth):
+        dpi, clip = plan_page_render(page, preset_name)
+        if dpi is None:
+            accuracies.append(character_accuracy(expected, ""))
+            continue
+        image_bytes, width, height = render_page_for_ocr(page, dpi, clip)
+        pixels += width * height
+        image = enhance_image_for_ocr(image_from_samples(image_bytes, width, height))
+        accuracies.append(character_accuracy(expected, backend.image_to_text(image, language)))
+    elapsed = time.perf_counter() - start
+    return {
+        'pages_per_second': doc.page_count / elapsed,
+        'accuracy': sum(accuracies) / len(accuracies),
+        'megapixels_per_page': pixels / doc.page_count / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare render presets by OCR throughput and character accuracy on a generated ground-truth sample.")
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--scan-dpi', type=int, default=300)
+    parser.add_argument('--language', default='eng')
+    parser.add_argument('--backend', default='auto')
+    parser.add_argument('--tesseract-cmd')
+    parser.add_argument('--tessdata-path')
+    args = parser.parse_args()
+
+    doc, ground_truth = build_ground_truth_pdf(args.pages, args.scan_dpi)
+    backend = get_ocr_backend({'backend': args.backend, 'tesseract_cmd': args.tesseract_cmd, 'tessdata_path': args.tessdata_path})
+
+    print(f"{'preset':<10}{'pages/sec':>12}{'accuracy':>12}{'MP/page':>10}")
+    for preset_name in RENDER_PRESETS:
+        result = run_preset(preset_name, doc, ground_truth, backend, args.language)
+        print(f"{preset_name:<10}{result['pages_per_second']:>12.2f}{result['accuracy'] * 100:>11.1f}%{result['megapixels_per_page']:>10.2f}")
+    doc.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import os
+import sys
+import time
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ocr import OCR_BACKENDS, enhance_image_for_ocr, get_ocr_backend, image_from_samples, render_page_for_ocr
+from ocr_input_benchmark import build_scanned_pdf
+
+
+def prepare_pages(doc):
+    pages = []
+    for page in doc:
+        image_bytes, width, height = render_page_for_ocr(page)
+        pages.append(enhance_image_for_ocr(image_from_samples(image_bytes, width, height)))
+    return pages
+
+
+def benchmark_backend(backend_name, pages, language, tesseract_cmd, tessdata_path):
+    backend = get_ocr_backend({'backend': backend_name, 'tesseract_cmd': tesseract_cmd, 'tessdata_path': tessdata_path})
+    if backend.name != backend_name:
+        return None
+
+    backend.image_to_text(pages[0], language)
+    start = time.perf_counter()
+    for image in pages:
+        backend.image_to_text(image, language)
+    elapsed = time.perf_counter() - start
+    return len(pages) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare OCR throughput of the available Tesseract backends in a single process.")
+    parser.add_argument('--pdf', help="Scanned PDF to use instead of a generated sample")
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--language', default='eng')
+    parser.add_argument('--tesseract-cmd')
+    parser.add_argument('--tessdata-path')
+    args = parser.parse_args()
+
+    doc = fitz.open(args.pdf) if args.pdf else build_scanned_pdf(args.pages)
+    pages = prepare_pages(doc)
+    doc.close()
+
+    print(f"{'backend':<12}{'pages/sec':>12}")
+    for backend_name in OCR_BACKENDS:
+        pages_per_second = benchmark_backend(backend_name, pages, args.language, args.tesseract_cmd, args.tessdata_path)
+        if pages_per_second is None:
+            print(f"{backend_name:<12}{'unavailable':>12}")
+        else:
+            print(f"{backend_name:<12}{pages_per_second:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
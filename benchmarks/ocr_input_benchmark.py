@@ -0,0 +1,113 @@
+import argparse
+import io
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import fitz
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ocr import enhance_image_for_ocr, image_from_samples, render_page_for_ocr
+
+SAMPLE_TEXT = "The quick brown fox jumps over the lazy dog. 0123456789 " * 3
+
+
+def build_scanned_pdf(num_pages):
+    text_doc = fitz.open()
+    page = text_doc.new_page()
+    for line in range(50):
+        page.insert_text((40, 40 + line * 15), SAMPLE_TEXT[:95], fontsize=9)
+    scan = page.get_pixmap(dpi=200)
+    text_doc.close()
+
+    doc = fitz.open()
+    for _ in range(num_pages):
+        scanned_page = doc.new_page()
+        scanned_page.insert_image(scanned_page.rect, pixmap=scan)
+    return doc
+
+
+def legacy_pipeline(page, dpi):
+    timings = {}
+    start = time.perf_counter()
+    pix = page.get_pixmap(dpi=dpi)
+    timings['render'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image_bytes = pix.tobytes("png")
+    timings['encode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    payload = pickle.loads(pickle.dumps(image_bytes))
+    timings['ipc'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    img = Image.open(io.BytesIO(payload))
+    img.load()
+    img = img.convert('L').point(lambda x: 0 if x < 128 else 255, '1')
+    timings['preprocess'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
+        img.save(temp_file, format='PNG')
+    os.remove(temp_file.name)
+    timings['tesseract_input'] = time.perf_counter() - start
+    return timings
+
+
+def raw_pipeline(page, dpi):
+    timings = {}
+    start = time.perf_counter()
+    image_bytes, width, height = render_page_for_ocr(page, dpi)
+    timings['render'] = time.perf_counter() - start
+    timings['encode'] = 0.0
+
+    start = time.perf_counter()
+    payload = pickle.loads(pickle.dumps(image_bytes))
+    timings['ipc'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    img = enhance_image_for_ocr(image_from_samples(payload, width, height))
+    timings['preprocess'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    header = f"P5\n{img.width} {img.height}\n255\n".encode('ascii')
+    header + img.tobytes()
+    timings['tesseract_input'] = time.perf_counter() - start
+    return timings
+
+
+def run(pipeline, doc, dpi):
+    totals = {}
+    for page in doc:
+        for stage, seconds in pipeline(page, dpi).items():
+            totals[stage] = totals.get(stage, 0.0) + seconds
+    return {stage: seconds * 1000 / doc.page_count for stage, seconds in totals.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-page cost of preparing a page for Tesseract (OCR itself excluded).")
+    parser.add_argument('--pdf', help="PDF to use instead of a generated scanned sample")
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--dpi', type=int, default=300)
+    args = parser.parse_args()
+
+    doc = fitz.open(args.pdf) if args.pdf else build_scanned_pdf(args.pages)
+    legacy = run(legacy_pipeline, doc, args.dpi)
+    raw = run(raw_pipeline, doc, args.dpi)
+    doc.close()
+
+    print(f"{'stage':<16}{'legacy ms':>12}{'raw ms':>12}")
+    for stage in legacy:
+        print(f"{stage:<16}{legacy[stage]:>12.1f}{raw[stage]:>12.1f}")
+    legacy_total = sum(legacy.values())
+    raw_total = sum(raw.values())
+    print(f"{'total':<16}{legacy_total:>12.1f}{raw_total:>12.1f}")
+    print(f"Saved {legacy_total - raw_total:.1f} ms per page at {args.dpi} DPI.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import fitz
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from ocr import extract_text_layer, is_error_result, plan_page_render, process_page_ocr, render_page_for_ocr
+
+CORPUS_KINDS = ['scanned', 'born_digital', 'mixed', 'multilang']
+OMITTED_STAGES = ['telegram', 'job_store', 'result_cache', 'fair_share_scheduler', 'output_writers']
+SAMPLE_TEXT = {
+    'eng': "The quick brown fox jumps over the lazy dog. Pack my box with five dozen liquor jugs.",
+    'rus': "Съешь же ещё этих мягких французских булок, да выпей чаю. Широкая электрификация южных губерний.",
+    'heb': "דג סקרן שט בים מאוכזב ולפתע מצא חברה. עטלף אבק נס דרך מזגן שהתפוצץ כי חם.",
+}
+
+
+def insert_text_page(doc, language, fonts):
+    page = doc.new_page()
+    font_name, font_file = fonts.get(language, ('helv', None))
+    if font_file:
+        page.insert_font(fontname=font_name, fontfile=font_file)
+    elif font_name != 'helv':
+        page.insert_font(fontname=font_name, fontbuffer=fitz.Font(font_name).buffer)
+    text = SAMPLE_TEXT[language]
+    for line in range(40):
+        page.insert_text((50, 60 + line * 18), text[:70], fontsize=10, fontname=font_name)
+    return page
+
+
+def insert_scanned_page(doc, language, fonts):
+    text_doc = fitz.open()
+    text_page = insert_text_page(text_doc, language, fonts)
+    scan = text_page.get_pixmap(dpi=200, colorspace=fitz.csGRAY)
+    text_doc.close()
+    page = doc.new_page()
+    page.insert_image(page.rect, pixmap=scan)
+
+
+def build_corpus_pdf(kind, num_pages, path, fonts):
+    doc = fitz.open()
+    languages = [language for language in ['eng', 'rus', 'heb'] if language in fonts]
+    page_languages = []
+    for page_index in range(num_pages):
+        page_language = 'eng'
+        if kind == 'scanned':
+            insert_scanned_page(doc, 'eng', fonts)
+        elif kind == 'born_digital':
+            insert_text_page(doc, 'eng', fonts)
+        elif kind == 'mixed':
+            if page_index % 2:
+                insert_scanned_page(doc, 'eng', fonts)
+            else:
+                insert_text_page(doc, 'eng', fonts)
+        else:
+            page_language = languages[page_index % len(languages)]
+            insert_scanned_page(doc, page_language, fonts)
+        page_languages.append(page_language)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return page_languages
+
+
+def peak_rss_mb(who):
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_pipeline(pdf_path, page_languages, workers, quality, ocr_options, use_text_layer, rotation_angle=0):
+    stages = {
+        'pool_start': 0.0, 'text_layer': 0.0, 'plan': 0.0, 'render': 0.0, 'ipc_wait': 0.0,
+        'orientation': 0.0, 'preprocess': 0.0, 'ocr': 0.0, 'assembly': 0.0,
+    }
+    wall_start = time.perf_counter()
+
+    stage_start = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    executor.submit(int, 0).result()
+    stages['pool_start'] = time.perf_counter() - stage_start
+
+    doc = fitz.open(pdf_path)
+    num_pages = doc.page_count
+    page_results = {}
+    pending = {}
+    text_layer_pages = 0
+    ocr_pages = 0
+    error_pages = 0
+    next_page_index = 0
+    render_ahead_pages = max(2, workers * 2)
+    while next_page_index < num_pages or pending:
+        while next_page_index < num_pages and len(pending) < render_ahead_pages:
+            i = next_page_index
+            next_page_index += 1
+            page = doc.load_page(i)
+            language = page_languages[i]
+            if use_text_layer:
+                stage_start = time.perf_counter()
+                native_text = extract_text_layer(page, language)
+                stages['text_layer'] += time.perf_counter() - stage_start
+                if native_text is not None:
+                    page_results[i + 1] = native_text
+                    text_layer_pages += 1
+                    continue
+
+            stage_start = time.perf_counter()
+            dpi, clip = plan_page_render(page, quality)
+            stages['plan'] += time.perf_counter() - stage_start
+            if dpi is None:
+                page_results[i + 1] = ""
+                continue
+
+            stage_start = time.perf_counter()
+            image_bytes, width, height = render_page_for_ocr(page, dpi, clip)
+            stages['render'] += time.perf_counter() - stage_start
+
+            future = executor.submit(process_page_ocr, i, image_bytes, width, height, language, rotation_angle, ocr_options)
+            pending[future] = time.perf_counter()
+
+        if not pending:
+            continue
+        done_futures, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done_futures:
+            submitted_at = pending.pop(future)
+            page_num, text, _rotation, timings, _layout = future.result()
+            page_results[page_num] = text
+            if is_error_result(text):
+                error_pages += 1
+            else:
+                ocr_pages += 1
+            worker_seconds = sum(timings.values())
+            stages['ipc_wait'] += max(0.0, time.perf_counter() - submitted_at - worker_seconds)
+            for stage, seconds in timings.items():
+                stages[stage] += seconds
+    doc.close()
+
+    stage_start = time.perf_counter()
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.txt', delete=False) as result_file:
+        for i in range(1, num_pages + 1):
+            result_file.write(f"\n\n===== PAGE {i} =====\n\n")
+            result_file.write(page_results.get(i, ""))
+    os.remove(result_file.name)
+    stages['assembly'] = time.perf_counter() - stage_start
+
+    executor.shutdown()
+    wall_seconds = time.perf_counter() - wall_start
+    return {
+        'pages': num_pages,
+        'text_layer_pages': text_layer_pages,
+        'ocr_pages': ocr_pages,
+        'error_pages': error_pages,
+        'wall_seconds': wall_seconds,
+        'pages_per_second': num_pages / wall_seconds,
+        'stages_seconds': stages,
+        'peak_rss_parent_mb': peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+        'peak_rss_worker_mb': peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+    }
+
+
+def run_isolated(run_spec):
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--single-run', json.dumps(run_spec)],
+        capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Benchmark run failed: {completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare_reports(baseline, current):
+    baseline_runs = {(run['corpus'], run['pages'], run['workers']): run for run in baseline['runs']}
+    print(f"{'corpus':<14}{'pages':>6}{'workers':>8}{'base p/s':>10}{'now p/s':>10}{'change':>9}")
+    for run in current['runs']:
+        base_run = baseline_runs.get((run['corpus'], run['pages'], run['workers']))
+        if base_run is None:
+            continue
+        if run.get('error_pages') or base_run.get('error_pages', 0):
+            print(f"{run['corpus']:<14}{run['pages']:>6}{run['workers']:>8}  skipped: OCR errors in one of the runs")
+            continue
+        change = (run['pages_per_second'] / base_run['pages_per_second'] - 1) * 100
+        print(f"{run['corpus']:<14}{run['pages']:>6}{run['workers']:>8}{base_run['pages_per_second']:>10.2f}{run['pages_per_second']:>10.2f}{change:>8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Headless end-to-end benchmark of the PDF-to-text pipeline.",
+        epilog="The benchmark runs the text layer, render planning, rendering and OCR stages of process_pdf_parallel on one cold job. "
+               "It leaves out Telegram I/O, the job store, the result cache, the fair-share OCR scheduler and the txt/pdf/hOCR/JSON writers. "
+               "Use --auto-rotation and --capture-layout to include orientation detection and word layout capture."
+    )
+    parser.add_argument('--corpus', default=','.join(CORPUS_KINDS), help="Comma-separated corpus kinds")
+    parser.add_argument('--pages', default='1,10,50', help="Comma-separated page counts, e.g. 1,10,100,500")
+    parser.add_argument('--workers', default=str(os.cpu_count() or 1), help="Comma-separated worker counts for scaling curves")
+    parser.add_argument('--language', default='eng', help="OCR language for the single-language corpora (multilang picks each page's own language)")
+    parser.add_argument('--quality', default='balanced')
+    parser.add_argument('--backend', default='auto')
+    parser.add_argument('--tesseract-cmd')
+    parser.add_argument('--tessdata-path')
+    parser.add_argument('--hebrew-font', help="TTF/OTF font with Hebrew glyphs for the multilang corpus")
+    parser.add_argument('--no-text-layer', action='store_true')
+    parser.add_argument('--auto-rotation', action='store_true', help="Detect each page's orientation like the bot's automatic rotation choice")
+    parser.add_argument('--capture-layout', action='store_true', help="Capture word boxes like the bot does when extra output formats are enabled")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--compare', help="Previous JSON report to compare pages/sec against")
+    parser.add_argument('--single-run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single_run:
+        run_spec = json.loads(args.single_run)
+        result = run_pipeline(
+            run_spec['pdf_path'], run_spec['page_languages'], run_spec['workers'], run_spec['quality'],
+            run_spec['ocr_options'], run_spec['use_text_layer'], run_spec['rotation']
+        )
+        print(json.dumps(result))
+        return
+
+    fonts = {'eng': ('helv', None), 'rus': ('cjk', None)}
+    if args.hebrew_font:
+        fonts['heb'] = ('hebrew', args.hebrew_font)
+    ocr_options = {
+        'backend': args.backend, 'tesseract_cmd': args.tesseract_cmd, 'tessdata_path': args.tessdata_path,
+        'capture_layout': args.capture_layout,
+    }
+    rotation_angle = None if args.auto_rotation else 0
+    corpus_kinds = [kind for kind in args.corpus.split(',') if kind]
+    page_counts = [int(count) for count in args.pages.split(',') if count]
+    worker_counts = [int(count) for count in args.workers.split(',') if count]
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {
+            'language': args.language, 'quality': args.quality, 'ocr_options': ocr_options,
+            'use_text_layer': not args.no_text_layer, 'auto_rotation': args.auto_rotation,
+        },
+        'omitted_stages': OMITTED_STAGES,
+        'runs': [],
+        'scaling': {},
+    }
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        for kind in corpus_kinds:
+            for num_pages in page_counts:
+                pdf_path = os.path.join(corpus_dir, f"{kind}_{num_pages}.pdf")
+                page_languages = build_corpus_pdf(kind, num_pages, pdf_path, fonts)
+                if kind != 'multilang':
+                    page_languages = [args.language] * num_pages
+                for workers in worker_counts:
+                    print(f"Running {kind} ({num_pages} pages) with {workers} workers...", file=sys.stderr)
+                    result = run_isolated({
+                        'pdf_path': pdf_path, 'page_languages': page_languages, 'workers': workers,
+                        'quality': args.quality, 'ocr_options': ocr_options, 'use_text_layer': not args.no_text_layer,
+                        'rotation': rotation_angle,
+                    })
+                    result.update({'corpus': kind, 'workers': workers})
+                    report['runs'].append(result)
+
+    for run in report['runs']:
+        curve = report['scaling'].setdefault(f"{run['corpus']}_{run['pages']}", [])
+        curve.append({'workers': run['workers'], 'pages_per_second': run['pages_per_second']})
+    for curve in report['scaling'].values():
+        base_rate = curve[0]['pages_per_second']
+        for point in curve:
+            point['speedup'] = point['pages_per_second'] / base_rate
+
+    report_json = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(report_json)
+    else:
+        print(report_json)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            compare_reports(json.load(baseline_file), report)
+
+    broken_runs = [run for run in report['runs'] if run['error_pages']]
+    if broken_runs:
+        for run in broken_runs:
+            print(f"Error: {run['corpus']} ({run['pages']} pages, {run['workers']} workers) had {run['error_pages']} pages fail OCR.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
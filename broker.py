@@ -0,0 +1,198 @@
+import json
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+DOCUMENT_CHUNK_SIZE = 8 * 1024 * 1024
+DOCUMENT_UPLOAD_BATCH_CHUNKS = 4
+DOCUMENT_TTL_SECONDS = 24 * 60 * 60
+TASK_TIMEOUT_SECONDS = 15 * 60
+RESULT_TTL_SECONDS = TASK_TIMEOUT_SECONDS
+
+
+class InProcessBroker:
+    def __init__(self):
+        self.tasks = queue.Queue()
+        self.results = {}
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    def publish_document(self, document_id, pdf_path):
+        self.documents[document_id] = pdf_path
+
+    def local_document_path(self, document_id):
+        return self.documents.get(document_id)
+
+    def fetch_document(self, document_id, destination_path):
+        with open(self.documents[document_id], 'rb') as source, open(destination_path, 'wb') as destination:
+            for chunk in iter(lambda: source.read(DOCUMENT_CHUNK_SIZE), b''):
+                destination.write(chunk)
+
+    def push_task(self, task):
+        self.tasks.put(json.dumps(task))
+
+    def pop_task(self, timeout):
+        try:
+            return json.loads(self.tasks.get(timeout=timeout))
+        except queue.Empty:
+            return None
+
+    def _results_queue(self, reply_to):
+        with self.lock:
+            return self.results.setdefault(reply_to, queue.Queue())
+
+    def push_result(self, reply_to, result):
+        self._results_queue(reply_to).put(json.dumps(result))
+
+    def pop_result(self, reply_to, timeout):
+        try:
+            return json.loads(self._results_queue(reply_to).get(timeout=timeout))
+        except queue.Empty:
+            return None
+
+
+class RedisBroker:
+    def __init__(self, redis_url, namespace='pdftextify'):
+        if redis is None:
+            raise RuntimeError("The redis package is required for the redis broker")
+        self.client = redis.Redis.from_url(redis_url)
+        self.namespace = namespace
+        self.tasks_key = f"{namespace}:tasks"
+
+    def _document_key(self, document_id):
+        return f"{self.namespace}:documents:{document_id}"
+
+    def publish_document(self, document_id, pdf_path):
+        document_key = self._document_key(document_id)
+        if self.client.exists(document_key):
+            self.client.expire(document_key, DOCUMENT_TTL_SECONDS)
+            return
+        upload_key = f"{document_key}:upload:{uuid.uuid4().hex}"
+        with open(pdf_path, 'rb') as source:
+            pipeline = self.client.pipeline(transaction=False)
+            batched_chunks = 0
+            for chunk in iter(lambda: source.read(DOCUMENT_CHUNK_SIZE), b''):
+                pipeline.rpush(upload_key, chunk)
+                batched_chunks += 1
+                if batched_chunks >= DOCUMENT_UPLOAD_BATCH_CHUNKS:
+                    pipeline.expire(upload_key, DOCUMENT_TTL_SECONDS)
+                    pipeline.execute()
+                    batched_chunks = 0
+            pipeline.expire(upload_key, DOCUMENT_TTL_SECONDS)
+            pipeline.execute()
+        self.client.rename(upload_key, document_key)
+
+    def local_document_path(self, document_id):
+        return None
+
+    def fetch_document(self, document_id, destination_path):
+        document_key = self._document_key(document_id)
+        num_chunks = self.client.llen(document_key)
+        if num_chunks == 0:
+            raise FileNotFoundError(f"Document {document_id} is not available in the broker")
+        with open(destination_path, 'wb') as destination:
+            for chunk_index in range(num_chunks):
+                destination.write(self.client.lindex(document_key, chunk_index))
+
+    def push_task(self, task):
+        self.client.lpush(self.tasks_key, json.dumps(task))
+
+    def pop_task(self, timeout):
+        item = self.client.brpop(self.tasks_key, timeout=max(1, int(timeout)))
+        return json.loads(item[1]) if item else None
+
+    def push_result(self, reply_to, result):
+        results_key = f"{self.namespace}:results:{reply_to}"
+        pipeline = self.client.pipeline()
+        pipeline.lpush(results_key, json.dumps(result))
+        pipeline.expire(results_key, RESULT_TTL_SECONDS)
+        pipeline.execute()
+
+    def pop_result(self, reply_to, timeout):
+        item = self.client.brpop(f"{self.namespace}:results:{reply_to}", timeout=max(1, int(timeout)))
+        return json.loads(item[1]) if item else None
+
+
+def create_broker(broker_name, config):
+    if broker_name == 'inprocess':
+        return InProcessBroker()
+    if broker_name == 'redis':
+        return RedisBroker(config.get('redis_url', 'redis://localhost:6379/0'), config.get('redis_namespace', 'pdftextify'))
+    raise ValueError(f"Unknown OCR broker: {broker_name}")
+
+
+class BrokerExecutor:
+    def __init__(self, broker):
+        self.broker = broker
+        self.reply_to = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.document_ids = {}
+        self.collector = threading.Thread(target=self._collect_results, name="broker-results", daemon=True)
+        self.collector.start()
+
+    def publish_document(self, pdf_path, document_id):
+        self.broker.publish_document(document_id, pdf_path)
+        with self.lock:
+            self.document_ids[pdf_path] = document_id
+
+    def release_document(self, pdf_path):
+        with self.lock:
+            self.document_ids.pop(pdf_path, None)
+
+    def submit(self, fn, pdf_path, page_index, language, rotation_angle, quality, ocr_options=None):
+        task_id = uuid.uuid4().hex
+        future = Future()
+        with self.lock:
+            document_id = self.document_ids.get(pdf_path)
+            if document_id is None:
+                raise RuntimeError(f"Document {pdf_path} was not published to the broker before its pages were queued")
+            self.pending[task_id] = (future, time.monotonic() + TASK_TIMEOUT_SECONDS)
+        self.broker.push_task({
+            'task_id': task_id,
+            'reply_to': self.reply_to,
+            'task': fn.__name__,
+            'document_id': document_id,
+            'page_index': page_index,
+            'language': language,
+            'rotation': rotation_angle,
+            'quality': quality,
+            'capture_layout': bool((ocr_options or {}).get('capture_layout')),
+        })
+        return future
+
+    def _expire_tasks(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [task_id for task_id, (_future, deadline) in self.pending.items() if deadline < now]
+            expired_futures = [self.pending.pop(task_id)[0] for task_id in expired]
+        for future in expired_futures:
+            future.set_exception(TimeoutError("No OCR worker returned a result for this page in time"))
+
+    def _collect_results(self):
+        while True:
+            try:
+                result = self.broker.pop_result(self.reply_to, timeout=5)
+            except Exception as e:
+                print(f"[Broker Error] Could not fetch OCR results: {e}")
+                time.sleep(5)
+                continue
+            self._expire_tasks()
+            if result is None:
+                continue
+            with self.lock:
+                pending = self.pending.pop(result['task_id'], None)
+            if pending is None:
+                continue
+            future, _deadline = pending
+            if result.get('error'):
+                future.set_exception(RuntimeError(result['error']))
+            else:
+                future.set_result((result['page_num'], result['text'], result['rotation'], result.get('timings', {}), result.get('layout')))
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import re
+import shutil
+import threading
+
+HASH_CHUNK_SIZE = 1024 * 1024
+OBJECT_REFERENCE = re.compile(r'\b(\d+) (\d+) R\b')
+BACK_REFERENCE = re.compile(r'/(?:Parent|P) \d+ \d+ R\b')
+CACHE_FILE_SUFFIXES = {'previews': '.jpg'}
+EVICT_TARGET_RATIO = 0.9
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_pdf_object(doc, xref, object_hashes, in_progress):
+    if xref in object_hashes:
+        return object_hashes[xref]
+    if xref in in_progress or not 0 < xref < doc.xref_length():
+        return "R"
+    in_progress.add(xref)
+    digest = hashlib.sha256()
+    digest.update(hash_pdf_source(doc, doc.xref_object(xref, compressed=True), object_hashes, in_progress).encode('utf-8', errors='replace'))
+    if doc.xref_is_stream(xref):
+        digest.update(doc.xref_stream_raw(xref) or b'')
+    in_progress.discard(xref)
+    object_hashes[xref] = digest.hexdigest()
+    return object_hashes[xref]
+
+def hash_pdf_source(doc, source, object_hashes, in_progress):
+    source = BACK_REFERENCE.sub('', source)
+    return OBJECT_REFERENCE.sub(lambda match: hash_pdf_object(doc, int(match.group(1)), object_hashes, in_progress), source)
+
+def page_resources(doc, page_xref):
+    xref = page_xref
+    while xref:
+        kind, value = doc.xref_get_key(xref, 'Resources')
+        if kind != 'null':
+            return value
+        kind, parent = doc.xref_get_key(xref, 'Parent')
+        xref = int(parent.split()[0]) if kind == 'xref' else 0
+    return ''
+
+def hash_page(page, object_hashes=None):
+    doc = page.parent
+    object_hashes = {} if object_hashes is None else object_hashes
+    digest = hashlib.sha256()
+    digest.update(f"{tuple(page.rect)}:{page.rotation}".encode('ascii'))
+    digest.update(page.read_contents())
+    digest.update(hash_pdf_source(doc, page_resources(doc, page.xref), object_hashes, set()).encode('utf-8', errors='replace'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        for kind in ['documents', 'pages', 'orientations', 'layouts', 'render_plans', 'previews']:
+            os.makedirs(os.path.join(cache_dir, kind), exist_ok=True)
+
+    def make_key(self, content_hash, language, rotation_angle):
+        return f"{content_hash}_{language}_{rotation_angle}"
+
+    def _path(self, kind, key):
+        return os.path.join(self.cache_dir, kind, key[:2], f"{key}{CACHE_FILE_SUFFIXES.get(kind, '.txt')}")
+
+    def get_path(self, kind, key):
+        path = self._path(kind, key)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            return None
+
+    def get(self, kind, key):
+        path = self.get_path(kind, key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get_bytes(self, kind, key):
+        path = self.get_path(kind, key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _temp_path(self, kind, key):
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path, f"{path}.{threading.get_ident()}.tmp"
+
+    def _commit(self, temp_path, path):
+        new_size = os.path.getsize(temp_path)
+        try:
+            old_size = os.path.getsize(path)
+        except FileNotFoundError:
+            old_size = 0
+        os.replace(temp_path, path)
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += new_size - old_size
+
+    def put(self, kind, key, text):
+        path, temp_path = self._temp_path(kind, key)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        self._commit(temp_path, path)
+
+    def put_bytes(self, kind, key, data):
+        path, temp_path = self._temp_path(kind, key)
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        self._commit(temp_path, path)
+
+    def put_file(self, kind, key, source_path):
+        path, temp_path = self._temp_path(kind, key)
+        shutil.copyfile(source_path, temp_path)
+        self._commit(temp_path, path)
+
+    def evict(self):
+        with self.lock:
+            if self.total_bytes is not None and self.total_bytes <= self.max_bytes:
+                return 0
+            entries = []
+            total_size = 0
+            for root, _dirs, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.endswith('.tmp'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total_size += stat.st_size
+
+            entries.sort()
+            evicted = 0
+            target_size = self.max_bytes * EVICT_TARGET_RATIO if total_size > self.max_bytes else total_size
+            for _mtime, size, path in entries:
+                if total_size <= target_size:
+                    break
+                try:
+                    os.remove(path)
+                    evicted += 1
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+            self.total_bytes = total_size
+            return evicted
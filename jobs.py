@@ -0,0 +1,198 @@
+import json
+import sqlite3
+import threading
+import traceback
+from datetime import datetime
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+JOB_FIELDS = [
+    'user_id', 'username', 'chat_id', 'pdf_path', 'original_name', 'pdf_filename',
+    'results_dir', 'file_hash', 'language', 'rotation'
+]
+JOB_FILE_FIELDS = ['pdf_path', 'original_name', 'pdf_filename', 'file_hash']
+
+
+class JobStore:
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    username TEXT,
+                    chat_id INTEGER NOT NULL,
+                    pdf_path TEXT NOT NULL,
+                    original_name TEXT NOT NULL,
+                    pdf_filename TEXT NOT NULL,
+                    results_dir TEXT NOT NULL,
+                    file_hash TEXT NOT NULL,
+                    language TEXT NOT NULL,
+                    rotation INTEGER,
+                    state TEXT NOT NULL,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS job_pages (
+                    job_id INTEGER NOT NULL,
+                    page_num INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    layout TEXT,
+                    PRIMARY KEY (job_id, page_num)
+                )
+            """)
+            page_columns = [row['name'] for row in self.connection.execute("PRAGMA table_info(job_pages)")]
+            if 'layout' not in page_columns:
+                self.connection.execute("ALTER TABLE job_pages ADD COLUMN layout TEXT")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS job_files (
+                    job_id INTEGER NOT NULL,
+                    file_index INTEGER NOT NULL,
+                    pdf_path TEXT NOT NULL,
+                    original_name TEXT NOT NULL,
+                    pdf_filename TEXT NOT NULL,
+                    file_hash TEXT NOT NULL,
+                    PRIMARY KEY (job_id, file_index)
+                )
+            """)
+
+    def _now(self):
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def create_job(self, files=None, **fields):
+        values = [fields[name] for name in JOB_FIELDS]
+        now = self._now()
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                f"INSERT INTO jobs ({', '.join(JOB_FIELDS)}, state, created_at, updated_at) "
+                f"VALUES ({', '.join('?' for _ in JOB_FIELDS)}, ?, ?, ?)",
+                values + [JOB_QUEUED, now, now]
+            )
+            job_id = cursor.lastrowid
+            for file_index, file_fields in enumerate(files or []):
+                self.connection.execute(
+                    f"INSERT INTO job_files (job_id, file_index, {', '.join(JOB_FILE_FIELDS)}) "
+                    f"VALUES (?, ?, {', '.join('?' for _ in JOB_FILE_FIELDS)})",
+                    [job_id, file_index] + [file_fields[name] for name in JOB_FILE_FIELDS]
+                )
+            return job_id
+
+    def get_job_files(self, job):
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {', '.join(JOB_FILE_FIELDS)} FROM job_files WHERE job_id = ? ORDER BY file_index", (job['id'],)
+            ).fetchall()
+        if not rows:
+            return [{name: job[name] for name in JOB_FILE_FIELDS}]
+        return [dict(row) for row in rows]
+
+    def count_active_jobs(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchone()[0]
+
+    def count_jobs_ahead(self, job_id):
+        with self.lock:
+            running_users = {row['user_id'] for row in self.connection.execute("SELECT user_id FROM jobs WHERE state = ?", (JOB_RUNNING,))}
+            running_jobs = self.connection.execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (JOB_RUNNING,)).fetchone()[0]
+            queued_jobs = self.connection.execute("SELECT id, user_id FROM jobs WHERE state = ?", (JOB_QUEUED,)).fetchall()
+        claim_order = {row['id']: (row['user_id'] in running_users, row['id']) for row in queued_jobs}
+        if job_id not in claim_order:
+            return running_jobs
+        return running_jobs + sum(1 for order in claim_order.values() if order < claim_order[job_id])
+
+    def claim_next_job(self):
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT * FROM jobs WHERE state = ? "
+                "ORDER BY user_id IN (SELECT user_id FROM jobs WHERE state = ?), id LIMIT 1",
+                (JOB_QUEUED, JOB_RUNNING)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (JOB_RUNNING, self._now(), row['id'])
+            )
+        job = dict(row)
+        job['state'] = JOB_RUNNING
+        job['queued_at'] = row['updated_at']
+        return job
+
+    def requeue_interrupted_jobs(self):
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET state = ?, updated_at = ? WHERE state = ?", (JOB_QUEUED, self._now(), JOB_RUNNING)
+            )
+            return cursor.rowcount
+
+    def save_page(self, job_id, page_num, text, layout=None):
+        layout_json = json.dumps(layout, ensure_ascii=False) if layout is not None else None
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO job_pages (job_id, page_num, text, layout) VALUES (?, ?, ?, ?)",
+                (job_id, page_num, text, layout_json)
+            )
+
+    def get_pages(self, job_id):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT page_num, text FROM job_pages WHERE job_id = ?", (job_id,)
+            ).fetchall()
+        return {row['page_num']: row['text'] for row in rows}
+
+    def get_page_layouts(self, job_id, first_page, last_page):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT page_num, layout FROM job_pages WHERE job_id = ? AND page_num BETWEEN ? AND ? AND layout IS NOT NULL",
+                (job_id, first_page, last_page)
+            ).fetchall()
+        return {row['page_num']: json.loads(row['layout']) for row in rows}
+
+    def finish_job(self, job_id, state, error=None):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?", (state, error, self._now(), job_id)
+            )
+            self.connection.execute("DELETE FROM job_pages WHERE job_id = ?", (job_id,))
+
+
+class JobDispatcher:
+    def __init__(self, job_store, handler, num_workers):
+        self.job_store = job_store
+        self.handler = handler
+        self.num_workers = num_workers
+        self.wake_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for worker_index in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f"job-dispatcher-{worker_index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def notify(self):
+        self.wake_event.set()
+
+    def _run(self):
+        while True:
+            self.wake_event.clear()
+            job = self.job_store.claim_next_job()
+            if job is None:
+                self.wake_event.wait(timeout=5)
+                continue
+            try:
+                self.handler(job)
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Job {job['id']} crashed: {e}\n{traceback.format_exc()}")
+                self.job_store.finish_job(job['id'], JOB_FAILED, str(e))
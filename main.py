@@ -1,17 +1,29 @@
 import telebot
 import fitz
 import pytesseract
-from PIL import Image
 import os
 from datetime import datetime
 import json
 from telebot import types
-from concurrent.futures import ProcessPoolExecutor, as_completed
-import io
+from concurrent.futures import ProcessPoolExecutor, Future, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, deque
+import threading
 import traceback
 import time
 import requests
 import shutil
+import zipfile
+import hashlib
+import io
+from PIL import Image, ImageDraw, ImageFont
+from ocr import RENDER_PRESETS, extract_text_layer, is_error_result, plan_page_render, process_page_ocr, render_analysis_image, render_and_ocr_page, render_page_for_ocr, resolve_ocr_backend_name
+from broker import BrokerExecutor, create_broker
+from worker import start_inprocess_workers
+from cache import ResultCache, hash_file, hash_page
+from jobs import JOB_DONE, JOB_FAILED, JobDispatcher, JobStore
+from metrics import MetricsRegistry, start_metrics_server
+from outputs import OUTPUT_SUFFIXES, HocrOutputWriter, JsonOutputWriter, SearchablePdfWriter, empty_page_layout, ocr_layout_to_page, text_layer_layout
 
 try:
     with open('config.json') as config_file:
@@ -52,11 +64,24 @@ except Exception as e:
      print(f"Warning: An error occurred during Tesseract setup: {e}")
      traceback.print_exc()
 
+TELEGRAM_API_URL = config.get('api_url')
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL.rstrip('/') + "/bot{0}/{1}"
+    telebot.apihelper.FILE_URL = TELEGRAM_API_URL.rstrip('/') + "/file/bot{0}/{1}"
+    print(f"Using Telegram Bot API server: {TELEGRAM_API_URL}")
+MAX_FILE_MB = config.get('max_file_mb', 2000 if TELEGRAM_API_URL else 20)
+MAX_FILE_BYTES = MAX_FILE_MB * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 bot = telebot.TeleBot(config['token'])
 BASE_DIR = "bot_storage"
 USERS_DIR = os.path.join(BASE_DIR, "users")
 SUPPORTED_LANGUAGES = {'עברית': 'heb', 'אנגלית': 'eng', 'רוסית': 'rus'}
+AUTO_ROTATION_LABEL = "🔄 זיהוי אוטומטי"
+ROTATION_CHOICES = {"0° (רגיל)": 0, "90° (ימינה)": 270, "180° (הפוך)": 180, "270° (שמאלה)": 90}
+ZIP_MIME_TYPES = {'application/zip', 'application/x-zip-compressed'}
 processing_files = {}
+processing_files_lock = threading.Lock()
 
 for directory in [BASE_DIR, USERS_DIR]:
     if not os.path.exists(directory):
@@ -67,6 +92,74 @@ if MAX_OCR_WORKERS is None or MAX_OCR_WORKERS < 1:
     MAX_OCR_WORKERS = 1
 print(f"Using up to {MAX_OCR_WORKERS} OCR worker processes.")
 
+MAX_QUEUED_JOBS = config.get('max_queued_jobs', 20)
+MAX_CONCURRENT_JOBS = max(1, config.get('max_concurrent_jobs', 8))
+JOBS_DB_PATH = os.path.join(BASE_DIR, "jobs.sqlite3")
+OCR_BROKER = config.get('ocr_broker', 'local')
+RENDER_IN_WORKER = OCR_BROKER != 'local'
+BROKER_MAX_IN_FLIGHT_PAGES = config.get('broker_max_in_flight_pages', 64)
+RENDER_AHEAD_PAGES = max(2, config.get('render_ahead_pages', BROKER_MAX_IN_FLIGHT_PAGES if RENDER_IN_WORKER else MAX_OCR_WORKERS * 2))
+
+STATUS_UPDATE_INTERVAL = config.get('status_update_interval', 3)
+PARTIAL_RESULT_PAGES = config.get('partial_result_pages', 0)
+
+USE_TEXT_LAYER = config.get('use_text_layer', True)
+PDF_CHUNK_PAGES = max(1, config.get('pdf_chunk_pages', 100))
+
+MAX_BATCH_FILES = config.get('max_batch_files', 50)
+PENDING_BATCH_TTL_SECONDS = config.get('pending_batch_ttl_minutes', 30) * 60
+MAX_ZIP_EXTRACT_BYTES = config.get('max_zip_extract_mb', 200) * 1024 * 1024
+BATCH_OUTPUT = config.get('batch_output', 'zip')
+if BATCH_OUTPUT not in ('zip', 'merged'):
+    print(f"Warning: Unknown batch_output '{BATCH_OUTPUT}'. Using 'zip'.")
+    BATCH_OUTPUT = 'zip'
+
+OCR_QUALITY = config.get('ocr_quality', 'balanced')
+if OCR_QUALITY not in RENDER_PRESETS:
+    print(f"Warning: Unknown ocr_quality '{OCR_QUALITY}'. Using 'balanced'.")
+    OCR_QUALITY = 'balanced'
+
+try:
+    OCR_BACKEND = resolve_ocr_backend_name(config.get('ocr_backend', 'auto'))
+except ValueError as e:
+    print(f"Warning: {e}. Using the tesseract command line instead.")
+    OCR_BACKEND = 'cli'
+OUTPUT_FORMATS = [output_format for output_format in config.get('output_formats', ['txt']) if output_format in OUTPUT_SUFFIXES]
+if not OUTPUT_FORMATS:
+    print("Warning: No valid output_formats configured. Using 'txt'.")
+    OUTPUT_FORMATS = ['txt']
+CAPTURE_LAYOUT = any(output_format != 'txt' for output_format in OUTPUT_FORMATS)
+SEARCHABLE_PDF_FONT = config.get('searchable_pdf_font')
+if 'pdf' in OUTPUT_FORMATS and not SEARCHABLE_PDF_FONT:
+    print("Warning: searchable_pdf_font is not set. Hebrew text will not be searchable in generated PDFs.")
+LAYOUT_BATCH_PAGES = 100
+
+PREVIEW_MAX_SIDE = config.get('preview_max_side', 1024)
+PREVIEW_CONTACT_SHEET = config.get('preview_contact_sheet', False)
+PREVIEW_JPEG_QUALITY = 80
+
+OCR_OPTIONS = {
+    'backend': OCR_BACKEND,
+    'tesseract_cmd': EFFECTIVE_TESSERACT_CMD,
+    'tessdata_path': config.get('tessdata_path'),
+    'capture_layout': CAPTURE_LAYOUT,
+}
+print(f"Using OCR backend: {OCR_BACKEND}. Output formats: {', '.join(OUTPUT_FORMATS)}")
+
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+CACHE_MAX_BYTES = config.get('cache_max_mb', 500) * 1024 * 1024
+result_cache = ResultCache(CACHE_DIR, CACHE_MAX_BYTES)
+
+METRICS_HOST = config.get('metrics_host', '127.0.0.1')
+METRICS_PORT = config.get('metrics_port', 0)
+TRACE_LOG_PATH = config.get('trace_log')
+metrics = MetricsRegistry(trace_path=TRACE_LOG_PATH)
+metrics.histogram('stage_seconds', "Time spent in each pipeline stage (download, preview, job_queue, render, page_queue, ipc, orientation, preprocess, ocr, send).")
+metrics.histogram('job_seconds', "End-to-end processing time of a job, from claim to result.")
+metrics.counter('pages_total', "Pages finished, by where the text came from.")
+metrics.counter('page_errors_total', "Pages that failed OCR.")
+metrics.counter('jobs_total', "Finished jobs, by final state.")
+
 
 def log_user_action(user_id, username, action):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -81,32 +174,252 @@ def get_user_directories(user_id):
             os.makedirs(directory)
     return user_pdfs_dir, user_results_dir
 
-def rotate_image(img, angle):
-    if angle == 0:
-        return img
-    return img.rotate(angle, expand=True)
+def download_telegram_file(file_path, destination_path):
+    if os.path.isabs(file_path) and os.path.exists(file_path):
+        shutil.copyfile(file_path, destination_path)
+        return
+    file_url = (telebot.apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(config['token'], file_path)
+    temp_path = f"{destination_path}.part"
+    with requests.get(file_url, stream=True, proxies=telebot.apihelper.proxy, timeout=(10, 120)) as response:
+        response.raise_for_status()
+        with open(temp_path, 'wb') as destination:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                destination.write(chunk)
+    os.replace(temp_path, destination_path)
+
+class OcrScheduler:
+    def __init__(self, max_workers, executor_factory=None):
+        self.max_workers = max_workers
+        self.executor_factory = executor_factory or (lambda: ProcessPoolExecutor(max_workers=max_workers))
+        self.executor = self.executor_factory()
+        self.condition = threading.Condition()
+        self.user_queues = OrderedDict()
+        self.in_flight = 0
+        self.dispatcher = threading.Thread(target=self._dispatch_loop, name="ocr-dispatcher", daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, user_id, fn, *args, job_id=None, page=None):
+        future = Future()
+        with self.condition:
+            self.user_queues.setdefault(user_id, deque()).append((future, fn, args, time.perf_counter(), {'job_id': job_id, 'page': page}))
+            self.condition.notify_all()
+        return future
+
+    def _next_task(self):
+        user_id, tasks = next(iter(self.user_queues.items()))
+        task = tasks.popleft()
+        del self.user_queues[user_id]
+        if tasks:
+            self.user_queues[user_id] = tasks
+        return task
+
+    def queued_tasks(self):
+        with self.condition:
+            return sum(len(tasks) for tasks in self.user_queues.values())
+
+    def _task_done(self, future, pool_future, dispatched_at, span_attributes):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+        try:
+            result = pool_future.result()
+        except Exception as e:
+            future.set_exception(e)
+            return
+        round_trip_seconds = time.perf_counter() - dispatched_at
+        if isinstance(result, tuple) and len(result) >= 4 and isinstance(result[3], dict):
+            metrics.record_span('ipc', max(0.0, round_trip_seconds - sum(result[3].values())), **span_attributes)
+        future.set_result(result)
+
+    def _submit_to_pool(self, fn, args):
+        try:
+            return self.executor.submit(fn, *args)
+        except BrokenProcessPool as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] OCR worker pool is broken, recreating it: {e}")
+            self.executor = self.executor_factory()
+            return self.executor.submit(fn, *args)
+
+    def _dispatch_loop(self):
+        while True:
+            with self.condition:
+                while not self.user_queues or self.in_flight >= self.max_workers:
+                    self.condition.wait()
+                future, fn, args, queued_at, span_attributes = self._next_task()
+                self.in_flight += 1
+            dispatched_at = time.perf_counter()
+            metrics.record_span('page_queue', dispatched_at - queued_at, **span_attributes)
+
+            if not future.set_running_or_notify_cancel():
+                with self.condition:
+                    self.in_flight -= 1
+                continue
+            try:
+                pool_future = self._submit_to_pool(fn, args)
+            except Exception as e:
+                with self.condition:
+                    self.in_flight -= 1
+                future.set_exception(e)
+                continue
+            pool_future.add_done_callback(
+                lambda done, future=future, dispatched_at=dispatched_at, span_attributes=span_attributes: self._task_done(future, done, dispatched_at, span_attributes)
+            )
+
+ocr_scheduler = None
+job_store = None
+job_dispatcher = None
+
 
-def enhance_image_for_ocr(image):
-    if image.mode != 'L':
-        image = image.convert('L')
-    image = image.point(lambda x: 0 if x < 128 else 255, '1')
-    return image
+class StatusMessage:
+    def __init__(self, chat_id, total_pages, user_id, username):
+        self.chat_id = chat_id
+        self.total_pages = total_pages
+        self.user_id = user_id
+        self.username = username
+        self.message_id = None
+        self.start_time = time.monotonic()
+        self.next_update_time = 0
+        self.last_text = None
+        self.initial_pages = 0
 
-def process_page_ocr(page_num, image_bytes, language, rotation_angle, tesseract_cmd_for_worker=None):
+    def format_text(self, done_pages):
+        progress = (done_pages / self.total_pages) * 100
+        text = f"⏳ עובדו {done_pages}/{self.total_pages} עמודים ({progress:.0f}%)"
+        elapsed = time.monotonic() - self.start_time
+        pages_this_run = done_pages - self.initial_pages
+        if pages_this_run > 0 and done_pages < self.total_pages and elapsed > 0:
+            eta_seconds = int((self.total_pages - done_pages) * elapsed / pages_this_run)
+            text += f"\nזמן משוער לסיום: {eta_seconds // 60}:{eta_seconds % 60:02d}"
+        return text
+
+    def start(self, done_pages=0):
+        self.initial_pages = done_pages
+        try:
+            sent_message = bot.send_message(self.chat_id, self.format_text(done_pages))
+            self.message_id = sent_message.message_id
+            self.next_update_time = time.monotonic() + STATUS_UPDATE_INTERVAL
+        except Exception as e:
+            log_user_action(self.user_id, self.username, f"Error sending status message: {e}")
+
+    def update(self, done_pages, force=False):
+        now = time.monotonic()
+        if self.message_id is None or (not force and now < self.next_update_time):
+            return
+        text = self.format_text(done_pages)
+        if text == self.last_text:
+            return
+        self.next_update_time = now + STATUS_UPDATE_INTERVAL
+        try:
+            bot.edit_message_text(text, self.chat_id, self.message_id)
+            self.last_text = text
+        except telebot.apihelper.ApiTelegramException as te:
+            retry_after = (te.result_json or {}).get('parameters', {}).get('retry_after')
+            if retry_after:
+                self.next_update_time = now + retry_after
+            log_user_action(self.user_id, self.username, f"Could not update status message: {te}")
+        except Exception as e:
+            log_user_action(self.user_id, self.username, f"Could not update status message: {e}")
+
+
+def write_pages_text(file_path, page_results_dict, first_page, last_page, page_offset=0):
+    with open(file_path, 'w', encoding='utf-8') as combined_file:
+        for i in range(first_page, last_page + 1):
+            page_text = page_results_dict.get(i, f"--- Text for page {i - page_offset} was not processed or result missing ---")
+            combined_file.write(f"\n\n===== PAGE {i - page_offset} =====\n\n")
+            combined_file.write(page_text)
+
+def write_document_outputs(job_id, document, page_results_dict, language):
+    first_page = document['first_page']
+    last_page = first_page + document['num_pages'] - 1
+    base_path = os.path.splitext(document['result_path'])[0]
+    write_pages_text(document['result_path'], page_results_dict, first_page, last_page, first_page - 1)
+    outputs = {'txt': document['result_path']}
+
+    writers = {}
+    if 'pdf' in OUTPUT_FORMATS:
+        writers['pdf'] = SearchablePdfWriter(document['file']['pdf_path'], base_path + OUTPUT_SUFFIXES['pdf'], language, SEARCHABLE_PDF_FONT, PDF_CHUNK_PAGES)
+    if 'hocr' in OUTPUT_FORMATS:
+        writers['hocr'] = HocrOutputWriter(base_path + OUTPUT_SUFFIXES['hocr'], language)
+    if 'json' in OUTPUT_FORMATS:
+        writers['json'] = JsonOutputWriter(base_path + OUTPUT_SUFFIXES['json'])
     try:
-        if tesseract_cmd_for_worker:
-             pytesseract.pytesseract.tesseract_cmd = tesseract_cmd_for_worker
-
-        img = Image.open(io.BytesIO(image_bytes))
-        rotated_img = rotate_image(img, rotation_angle)
-        enhanced_img = enhance_image_for_ocr(rotated_img)
-        custom_config = f'--oem 3 --psm 6 -l {language}'
-        text = pytesseract.image_to_string(enhanced_img, lang=language, config=custom_config)
-        return page_num + 1, text.strip()
-    except Exception as e:
-        tb_str = traceback.format_exc()
-        print(f"[Worker Error] Page {page_num + 1}: Failed OCR processing - {e}\n{tb_str}")
-        return page_num + 1, f"--- Error processing page {page_num + 1} ---"
+        for batch_first_page in range(first_page, last_page + 1, LAYOUT_BATCH_PAGES) if writers else []:
+            batch_last_page = min(batch_first_page + LAYOUT_BATCH_PAGES - 1, last_page)
+            layouts = job_store.get_page_layouts(job_id, batch_first_page, batch_last_page)
+            for page_num in range(batch_first_page, batch_last_page + 1):
+                for writer in writers.values():
+                    writer.write_page(page_num - first_page + 1, page_results_dict.get(page_num, ""), layouts.get(page_num))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    outputs.update({output_format: writer.path for output_format, writer in writers.items()})
+    return outputs
+
+def write_batch_output(results_dir, pdf_filename_base, file_results):
+    output_paths = []
+    archive_formats = list(OUTPUT_FORMATS)
+    if BATCH_OUTPUT == 'merged' and 'txt' in archive_formats:
+        output_path = os.path.join(results_dir, f'{pdf_filename_base}.txt')
+        with open(output_path, 'w', encoding='utf-8') as merged_file:
+            for original_name, outputs in file_results:
+                merged_file.write(f"\n\n########## FILE: {original_name} ##########\n")
+                with open(outputs['txt'], 'r', encoding='utf-8') as result_file:
+                    shutil.copyfileobj(result_file, merged_file)
+        output_paths.append(output_path)
+        archive_formats.remove('txt')
+    if not archive_formats:
+        return output_paths
+
+    output_path = os.path.join(results_dir, f'{pdf_filename_base}.zip')
+    used_names = set()
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for original_name, outputs in file_results:
+            archive_name = original_name
+            name_suffix = 1
+            while archive_name in used_names:
+                name_suffix += 1
+                archive_name = f"{original_name}_{name_suffix}"
+            used_names.add(archive_name)
+            for output_format in archive_formats:
+                if output_format in outputs:
+                    archive.write(outputs[output_format], f"{archive_name}{OUTPUT_SUFFIXES[output_format]}")
+    output_paths.append(output_path)
+    return output_paths
+
+def make_document_output_key(cache_key, output_format):
+    return cache_key if output_format == 'txt' else f"{cache_key}_{output_format}"
+
+def find_cached_document(cache_key):
+    cached_outputs = {}
+    for output_format in set(OUTPUT_FORMATS) | {'txt'}:
+        cached_path = result_cache.get_path('documents', make_document_output_key(cache_key, output_format))
+        if not cached_path:
+            return None
+        cached_outputs[output_format] = cached_path
+    return cached_outputs
+
+def restore_cached_document(cached_outputs, result_path):
+    base_path = os.path.splitext(result_path)[0]
+    outputs = {}
+    for output_format, cached_path in cached_outputs.items():
+        outputs[output_format] = base_path + OUTPUT_SUFFIXES[output_format]
+        shutil.copyfile(cached_path, outputs[output_format])
+    return outputs
+
+def collect_result_files(results_dir, pdf_filename_base, original_name, file_results):
+    if len(file_results) > 1:
+        return [(output_path, f"תוצאות עבור {len(file_results)} קבצים") for output_path in write_batch_output(results_dir, pdf_filename_base, file_results)]
+    outputs = file_results[0][1]
+    return [
+        (outputs[output_format], f"טקסט שחולץ מתוך: {original_name}{OUTPUT_SUFFIXES[output_format]}")
+        for output_format in OUTPUT_FORMATS if output_format in outputs
+    ]
+
+def send_result_files(chat_id, result_files, user_id, username, job_id=None):
+    for result_file_path, result_caption in result_files:
+        log_user_action(user_id, username, f"Processing complete. Sending result file: {result_file_path}")
+        with metrics.span('send', job_id=job_id), open(result_file_path, 'rb') as result_file_to_send:
+            bot.send_document(chat_id, result_file_to_send, caption=result_caption)
+
 
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
@@ -130,54 +443,118 @@ def get_user_id(message):
         log_user_action(user_id, username, f"Error sending ID: {e}")
 
 
+def make_file_entry(pdf_path, original_filename, pdf_filename):
+    return {
+        'pdf_path': pdf_path,
+        'original_name': os.path.splitext(original_filename)[0],
+        'pdf_filename': pdf_filename,
+        'file_hash': hash_file(pdf_path)
+    }
+
+def extract_zip_pdfs(zip_path, user_pdfs_dir, timestamp):
+    file_entries = []
+    extracted_bytes = 0
+    with zipfile.ZipFile(zip_path) as archive:
+        for member in archive.infolist():
+            if member.is_dir() or not member.filename.lower().endswith('.pdf'):
+                continue
+            if len(file_entries) >= MAX_BATCH_FILES:
+                break
+            extracted_bytes += member.file_size
+            if extracted_bytes > MAX_ZIP_EXTRACT_BYTES:
+                raise ValueError(f"ZIP archive expands to more than {MAX_ZIP_EXTRACT_BYTES // (1024 * 1024)}MB")
+            member_filename = os.path.basename(member.filename)
+            pdf_filename = f"{timestamp}_{len(file_entries)}_{member_filename}"
+            pdf_path = os.path.join(user_pdfs_dir, pdf_filename)
+            with archive.open(member) as source, open(pdf_path, 'wb') as destination:
+                shutil.copyfileobj(source, destination)
+            file_entries.append(make_file_entry(pdf_path, member_filename, pdf_filename))
+    return file_entries
+
 @bot.message_handler(content_types=['document'])
 def handle_pdf(message):
     user_id = message.from_user.id
     username = message.from_user.username or "Unknown"
     try:
-        if message.document.mime_type != 'application/pdf':
-            log_user_action(user_id, username, f"Sent non-PDF file: {message.document.file_name}")
-            bot.reply_to(message, "אנא שלח/י קובץ PDF.")
+        original_filename = message.document.file_name or "document.pdf"
+        is_zip = message.document.mime_type in ZIP_MIME_TYPES or original_filename.lower().endswith('.zip')
+        if message.document.mime_type != 'application/pdf' and not is_zip:
+            log_user_action(user_id, username, f"Sent non-PDF file: {original_filename}")
+            bot.reply_to(message, "אנא שלח/י קובץ PDF או ארכיון ZIP עם קבצי PDF.")
             return
 
-        log_user_action(user_id, username, f"Uploaded PDF: {message.document.file_name}")
+        log_user_action(user_id, username, f"Uploaded {'ZIP' if is_zip else 'PDF'}: {original_filename}")
         user_pdfs_dir, user_results_dir = get_user_directories(user_id)
 
-        file_info = bot.get_file(message.document.file_id)
-        if file_info.file_size > 20 * 1024 * 1024:
-            log_user_action(user_id, username, f"PDF too large: {message.document.file_name} ({file_info.file_size} bytes)")
-            bot.reply_to(message, "הקובץ PDF גדול מדי (מעל 20MB). אנא שלח/י קובץ קטן יותר.")
+        if (message.document.file_size or 0) > MAX_FILE_BYTES:
+            log_user_action(user_id, username, f"File too large: {original_filename} ({message.document.file_size} bytes)")
+            bot.reply_to(message, f"הקובץ גדול מדי (מעל {MAX_FILE_MB}MB). אנא שלח/י קובץ קטן יותר.")
             return
+        file_info = bot.get_file(message.document.file_id)
 
-        original_filename = message.document.file_name
-        original_name = os.path.splitext(original_filename)[0]
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
         safe_original_filename = os.path.basename(original_filename)
         pdf_filename = f"{timestamp}_{safe_original_filename}"
         pdf_path = os.path.join(user_pdfs_dir, pdf_filename)
 
-        downloaded_file = bot.download_file(file_info.file_path)
-        with open(pdf_path, 'wb') as new_file:
-            new_file.write(downloaded_file)
+        with metrics.span('download', user_id=user_id, file_size=file_info.file_size):
+            download_telegram_file(file_info.file_path, pdf_path)
+
+        if is_zip:
+            try:
+                file_entries = extract_zip_pdfs(pdf_path, user_pdfs_dir, timestamp)
+            finally:
+                os.remove(pdf_path)
+            if not file_entries:
+                log_user_action(user_id, username, f"ZIP archive {original_filename} contains no PDF files.")
+                bot.reply_to(message, "לא נמצאו קבצי PDF בארכיון ה-ZIP.")
+                return
+            log_user_action(user_id, username, f"Extracted {len(file_entries)} PDF files from {original_filename}.")
+        else:
+            file_entries = [make_file_entry(pdf_path, safe_original_filename, pdf_filename)]
+
+        with processing_files_lock:
+            file_data = processing_files.get(user_id)
+            expired_files = 0
+            if file_data is not None and time.monotonic() - file_data['updated_at'] > PENDING_BATCH_TTL_SECONDS:
+                expired_files = len(file_data['files'])
+                file_data = None
+            is_new_batch = file_data is None
+            if is_new_batch:
+                file_data = {'files': [], 'results_dir': user_results_dir}
+                processing_files[user_id] = file_data
+            file_data['updated_at'] = time.monotonic()
+            accepted_entries = file_entries[:MAX_BATCH_FILES - len(file_data['files'])]
+            file_data['files'].extend(accepted_entries)
+            total_files = len(file_data['files'])
+            awaiting_language = 'language' not in file_data
 
-        processing_files[user_id] = {
-            'pdf_path': pdf_path,
-            'original_name': original_name,
-            'pdf_filename': pdf_filename,
-            'results_dir': user_results_dir
-        }
-        ask_language(message)
+        if expired_files:
+            log_user_action(user_id, username, f"Discarded an abandoned pending batch of {expired_files} files and started a new one.")
+
+        if len(accepted_entries) < len(file_entries):
+            log_user_action(user_id, username, f"Batch limit of {MAX_BATCH_FILES} files reached. Ignored {len(file_entries) - len(accepted_entries)} files.")
+            bot.reply_to(message, f"ניתן לעבד עד {MAX_BATCH_FILES} קבצים באצווה אחת. הקבצים העודפים לא נוספו.")
+
+        if is_new_batch:
+            ask_language(message)
+        elif message.media_group_id is None and accepted_entries:
+            log_user_action(user_id, username, f"Added {len(accepted_entries)} files to the pending batch ({total_files} files).")
+            bot.reply_to(message, f"הקובץ נוסף לאצווה. סה\"כ {total_files} קבצים. השפה והסיבוב שייבחרו יחולו על כולם.")
+            if awaiting_language:
+                ask_language(message)
+            else:
+                ask_rotation(message)
 
     except telebot.apihelper.ApiTelegramException as te:
         log_user_action(user_id, username, f"Telegram API error handling PDF: {str(te)}")
         bot.reply_to(message, f"אירעה שגיאת API בקליטת הקובץ: {str(te)}. ייתכן שהקובץ גדול מדי.")
-        if user_id in processing_files:
-            del processing_files[user_id]
+    except zipfile.BadZipFile as bz:
+        log_user_action(user_id, username, f"Invalid ZIP archive: {str(bz)}")
+        bot.reply_to(message, "ארכיון ה-ZIP פגום או אינו נתמך.")
     except Exception as e:
         log_user_action(user_id, username, f"Error handling PDF: {str(e)}\n{traceback.format_exc()}")
         bot.reply_to(message, f"אירעה שגיאה בקליטת הקובץ: {str(e)}")
-        if user_id in processing_files:
-            del processing_files[user_id]
 
 def ask_language(message):
     markup = types.ReplyKeyboardMarkup(row_width=1, one_time_keyboard=True, resize_keyboard=True)
@@ -202,6 +579,7 @@ def handle_language_selection(message):
         log_user_action(user_id, username, f"Selected language: {selected_language_name} ({selected_language_code})")
 
         processing_files[user_id]['language'] = selected_language_code
+        processing_files[user_id]['updated_at'] = time.monotonic()
         send_first_page_preview(message, user_id)
 
     except Exception as e:
@@ -210,66 +588,91 @@ def handle_language_selection(message):
         if user_id in processing_files:
             del processing_files[user_id]
 
+def make_render_plan_key(page_hash):
+    return f"{page_hash}_{OCR_QUALITY}"
+
+def build_rotation_contact_sheet(image):
+    cell_side = PREVIEW_MAX_SIDE // 2
+    label_height = cell_side // 10
+    font = ImageFont.load_default(size=label_height * 0.7)
+    sheet = Image.new('L', (cell_side * 2, cell_side * 2), 255)
+    draw = ImageDraw.Draw(sheet)
+    for choice_index, (label, pil_angle) in enumerate(ROTATION_CHOICES.items()):
+        cell = image.rotate(pil_angle, expand=True, fillcolor=255)
+        cell.thumbnail((cell_side - 8, cell_side - label_height - 8))
+        cell_x = (choice_index % 2) * cell_side
+        cell_y = (choice_index // 2) * cell_side
+        sheet.paste(cell, (cell_x + (cell_side - cell.width) // 2, cell_y + label_height + 4))
+        draw.text((cell_x + cell_side // 2, cell_y + label_height // 2), label.split()[0], fill=0, font=font, anchor='mm')
+        draw.rectangle((cell_x, cell_y, cell_x + cell_side - 1, cell_y + cell_side - 1), outline=160)
+    return sheet
+
+def render_first_page_preview(file_entry):
+    with fitz.open(file_entry['pdf_path']) as doc:
+        if doc.page_count == 0:
+            return None
+        page = doc.load_page(0)
+        analysis_image = render_analysis_image(page)
+        render_dpi, render_clip = plan_page_render(page, OCR_QUALITY, analysis_image)
+        render_plan = [render_dpi, list(render_clip) if render_clip is not None else None]
+        result_cache.put('render_plans', make_render_plan_key(hash_page(page)), json.dumps(render_plan))
+
+    if PREVIEW_CONTACT_SHEET:
+        preview_image = build_rotation_contact_sheet(analysis_image)
+    else:
+        preview_image = analysis_image.copy()
+        preview_image.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE))
+    preview_buffer = io.BytesIO()
+    preview_image.save(preview_buffer, 'JPEG', quality=PREVIEW_JPEG_QUALITY)
+    return preview_buffer.getvalue()
+
 def send_first_page_preview(message, user_id):
     if user_id not in processing_files: return
 
-    file_data = processing_files[user_id]
-    pdf_path = file_data['pdf_path']
+    file_entry = processing_files[user_id]['files'][0]
     username = message.from_user.username or "Unknown"
-
-    temp_preview_dir = os.path.join(BASE_DIR, "temp_previews")
-    if not os.path.exists(temp_preview_dir):
-        os.makedirs(temp_preview_dir)
-    
-    preview_filename = f"preview_{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.jpg"
-    preview_path = os.path.join(temp_preview_dir, preview_filename)
+    preview_key = f"{file_entry['file_hash']}_{'sheet' if PREVIEW_CONTACT_SHEET else 'page'}_{PREVIEW_MAX_SIDE}"
 
     try:
-        doc = fitz.open(pdf_path)
-        if doc.page_count == 0:
-            log_user_action(user_id, username, "PDF has no pages, cannot generate preview.")
-            bot.reply_to(message, "הקובץ PDF ריק או פגום, לא ניתן ליצור תצוגה מקדימה.", reply_markup=types.ReplyKeyboardRemove())
-            if user_id in processing_files: del processing_files[user_id]
-            if doc: doc.close()
-            return
-
-        page = doc.load_page(0)
-        pix = page.get_pixmap(dpi=150)
-        doc.close()
-
-        pix.save(preview_path, "jpeg")
+        preview_start = time.perf_counter()
+        preview_bytes = result_cache.get_bytes('previews', preview_key)
+        if preview_bytes is None:
+            preview_bytes = render_first_page_preview(file_entry)
+            if preview_bytes is None:
+                log_user_action(user_id, username, "PDF has no pages, cannot generate preview.")
+                bot.reply_to(message, "הקובץ PDF ריק או פגום, לא ניתן ליצור תצוגה מקדימה.", reply_markup=types.ReplyKeyboardRemove())
+                if user_id in processing_files: del processing_files[user_id]
+                return
+            result_cache.put_bytes('previews', preview_key, preview_bytes)
+        else:
+            log_user_action(user_id, username, "Using cached first page preview.")
 
-        with open(preview_path, 'rb') as preview_file:
-            bot.send_photo(
-                message.chat.id,
-                preview_file,
-                caption="הנה תצוגה מקדימה של העמוד הראשון. אנא בחר/י את כיוון הדף הנכון:",
-            )
+        if PREVIEW_CONTACT_SHEET:
+            caption = "הנה העמוד הראשון בכל אחד מהכיוונים האפשריים. אנא בחר/י את הכיוון שבו הטקסט מוצג ישר:"
+        else:
+            caption = "הנה תצוגה מקדימה של העמוד הראשון. אנא בחר/י את כיוון הדף הנכון:"
+        bot.send_photo(message.chat.id, preview_bytes, caption=caption)
+        metrics.record_span('preview', time.perf_counter() - preview_start, user_id=user_id)
         ask_rotation(message)
 
     except Exception as e:
         log_user_action(user_id, username, f"Error generating preview: {str(e)}\n{traceback.format_exc()}")
         bot.reply_to(message, f"אירעה שגיאה בהכנת תצוגה מקדימה: {str(e)}", reply_markup=types.ReplyKeyboardRemove())
         if user_id in processing_files: del processing_files[user_id]
-    finally:
-        if os.path.exists(preview_path):
-            try:
-                os.remove(preview_path)
-            except OSError as oe:
-                 log_user_action(user_id, username, f"Warning: Could not delete temp preview file {preview_path}: {oe}")
 
-def ask_rotation(message):
+def make_rotation_markup():
     markup = types.ReplyKeyboardMarkup(row_width=2, one_time_keyboard=True, resize_keyboard=True)
-    markup.add(
-        types.KeyboardButton("0° (רגיל)"), types.KeyboardButton("90° (ימינה)"),
-        types.KeyboardButton("180° (הפוך)"), types.KeyboardButton("270° (שמאלה)")
-    )
+    markup.add(*[types.KeyboardButton(label) for label in ROTATION_CHOICES])
+    markup.add(types.KeyboardButton(AUTO_ROTATION_LABEL))
+    return markup
+
+def ask_rotation(message):
     try:
-        bot.send_message(message.chat.id, "באיזו זווית יש לסובב את כל העמודים?", reply_markup=markup)
+        bot.send_message(message.chat.id, "באיזו זווית יש לסובב את כל העמודים?", reply_markup=make_rotation_markup())
     except Exception as e:
         log_user_action(message.from_user.id, message.from_user.username or "Unknown", f"Error asking rotation: {e}")
 
-@bot.message_handler(func=lambda message: message.text in ["0° (רגיל)", "90° (ימינה)", "180° (הפוך)", "270° (שמאלה)"])
+@bot.message_handler(func=lambda message: message.text in ROTATION_CHOICES or message.text == AUTO_ROTATION_LABEL)
 def handle_rotation_selection(message):
     user_id = message.from_user.id
     username = message.from_user.username or "Unknown"
@@ -282,14 +685,65 @@ def handle_rotation_selection(message):
              bot.reply_to(message, "אנא בחר/י שפה תחילה.", reply_markup=types.ReplyKeyboardRemove())
              return
 
-        angle_map = {
-            "0° (רגיל)": 0, "90° (ימינה)": 270,
-            "180° (הפוך)": 180, "270° (שמאלה)": 90
-        }
-        selected_angle_for_pil = angle_map[message.text]
-        log_user_action(user_id, username, f"Selected rotation: {message.text} (Mapped to {selected_angle_for_pil}° for PIL)")
+        selected_angle_for_pil = ROTATION_CHOICES.get(message.text)
+        if selected_angle_for_pil is None:
+            log_user_action(user_id, username, f"Selected rotation: {message.text} (Per-page orientation detection)")
+        else:
+            log_user_action(user_id, username, f"Selected rotation: {message.text} (Mapped to {selected_angle_for_pil}° for PIL)")
+
+        rotation_key = 'auto' if selected_angle_for_pil is None else selected_angle_for_pil
+        with processing_files_lock:
+            file_data = processing_files[user_id]
+            files = file_data['files']
+            cached_documents = [
+                find_cached_document(result_cache.make_key(file_entry['file_hash'], file_data['language'], rotation_key))
+                for file_entry in files
+            ]
+            fully_cached = all(cached_outputs is not None for cached_outputs in cached_documents)
+            if not fully_cached and job_store.count_active_jobs() >= MAX_QUEUED_JOBS:
+                log_user_action(user_id, username, f"Job queue is full ({MAX_QUEUED_JOBS} jobs). Keeping {len(files)} pending PDF files starting with: {files[0]['original_name']}")
+                bot.reply_to(message, "התור מלא כרגע. הקבצים שלך נשמרו, אנא בחר/י את הסיבוב שוב בעוד מספר דקות.", reply_markup=make_rotation_markup())
+                return
+            del processing_files[user_id]
+
+        if fully_cached:
+            log_user_action(user_id, username, f"Found cached results for all {len(files)} PDF files. Skipping the job queue.")
+            file_results = [
+                (file_entry['original_name'], restore_cached_document(
+                    cached_outputs, os.path.join(file_data['results_dir'], f"{os.path.splitext(file_entry['pdf_filename'])[0]}.txt")
+                ))
+                for file_entry, cached_outputs in zip(files, cached_documents)
+            ]
+            batch_filename_base = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_batch_{len(files)}_files"
+            bot.reply_to(message, "הקובץ כבר עובד בעבר, שולח את התוצאה השמורה.", reply_markup=types.ReplyKeyboardRemove())
+            send_result_files(message.chat.id, collect_result_files(file_data['results_dir'], batch_filename_base, files[0]['original_name'], file_results), user_id, username)
+            bot.send_message(message.chat.id, "✅ עיבוד הקובץ הושלם!")
+            return
 
-        processing_files[user_id]['rotation'] = selected_angle_for_pil
+        if len(files) == 1:
+            job_fields = files[0]
+        else:
+            batch_hash = hashlib.sha256(",".join(file_entry['file_hash'] for file_entry in files).encode('ascii')).hexdigest()
+            job_fields = {
+                'pdf_path': files[0]['pdf_path'],
+                'original_name': f"batch_{len(files)}_files",
+                'pdf_filename': f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_batch_{len(files)}_files",
+                'file_hash': batch_hash
+            }
+        job_id = job_store.create_job(
+            files=files,
+            user_id=user_id,
+            username=username,
+            chat_id=message.chat.id,
+            pdf_path=job_fields['pdf_path'],
+            original_name=job_fields['original_name'],
+            pdf_filename=job_fields['pdf_filename'],
+            results_dir=file_data['results_dir'],
+            file_hash=job_fields['file_hash'],
+            language=file_data['language'],
+            rotation=selected_angle_for_pil
+        )
+        log_user_action(user_id, username, f"Created job {job_id} for {len(files)} PDF files: {', '.join(file_entry['original_name'] for file_entry in files)}")
 
         bot.reply_to(
             message,
@@ -297,8 +751,11 @@ def handle_rotation_selection(message):
             reply_markup=types.ReplyKeyboardRemove()
         )
 
-        bot.send_chat_action(message.chat.id, 'upload_document')
-        process_pdf_parallel(message, user_id)
+        jobs_ahead = job_store.count_jobs_ahead(job_id)
+        if jobs_ahead >= MAX_CONCURRENT_JOBS:
+            log_user_action(user_id, username, f"Job {job_id} queued behind {jobs_ahead} other jobs.")
+            bot.send_message(message.chat.id, f"הקובץ שלך נכנס לתור. מיקום בתור: {jobs_ahead - MAX_CONCURRENT_JOBS + 1}")
+        job_dispatcher.notify()
 
     except Exception as e:
         log_user_action(user_id, username, f"Error handling rotation selection: {str(e)}\n{traceback.format_exc()}")
@@ -306,116 +763,345 @@ def handle_rotation_selection(message):
         if user_id in processing_files:
             del processing_files[user_id]
 
-def process_pdf_parallel(message, user_id):
-    if user_id not in processing_files:
-        log_user_action(user_id, message.from_user.username or "Unknown", "Error: No processing state found for parallel processing.")
-        bot.send_message(message.chat.id, "שגיאה פנימית: מידע עיבוד לא נמצא. אנא נסה לשלוח את הקובץ מחדש.")
-        return
-
-    file_data = processing_files[user_id]
-    pdf_path = file_data['pdf_path']
-    results_dir = file_data['results_dir']
-    language = file_data['language']
-    rotation_angle = file_data['rotation']
-    original_name = file_data['original_name']
-    pdf_filename_base = os.path.splitext(file_data['pdf_filename'])[0]
-    username = message.from_user.username or "Unknown"
-    
-    result_file_path = os.path.join(results_dir, f'{pdf_filename_base}.txt')
+def process_pdf_parallel(job):
+    job_id = job['id']
+    user_id = job['user_id']
+    username = job['username'] or "Unknown"
+    chat_id = job['chat_id']
+    results_dir = job['results_dir']
+    language = job['language']
+    rotation_angle = job['rotation']
+    original_name = job['original_name']
+    pdf_filename_base = os.path.splitext(job['pdf_filename'])[0]
+    job_files = job_store.get_job_files(job)
+    is_batch = len(job_files) > 1
 
-    log_user_action(user_id, username, f"Starting parallel processing for PDF: {original_name} (Lang: {language}, Angle: {rotation_angle}°)")
+    rotation_key = 'auto' if rotation_angle is None else rotation_angle
+    log_user_action(user_id, username, f"Starting parallel processing for job {job_id}, {len(job_files)} PDF files: {original_name} (Lang: {language}, Angle: {rotation_key})")
     start_time = datetime.now()
+    job_start = time.perf_counter()
+    queued_seconds = (start_time - datetime.strptime(job['queued_at'], "%Y-%m-%d %H:%M:%S")).total_seconds()
+    metrics.record_span('job_queue', max(0.0, queued_seconds), job_id=job_id)
 
-    page_results_dict = {}
+    page_results_dict = job_store.get_pages(job_id)
     page_submission_futures = {}
+    page_hashes = {}
+    page_geometry = {}
+    failed_pages = set()
+    documents = []
+    open_doc = None
+    published_documents = set()
 
-    doc = None
+    job_state = JOB_FAILED
+    job_error = None
     try:
-        doc = fitz.open(pdf_path)
-        num_pages = doc.page_count
-        if num_pages == 0:
+        next_first_page = 1
+        cached_files = 0
+        for file_entry in job_files:
+            document = {
+                'file': file_entry,
+                'first_page': next_first_page,
+                'num_pages': 0,
+                'cache_key': result_cache.make_key(file_entry['file_hash'], language, rotation_key),
+                'result_path': os.path.join(results_dir, f"{os.path.splitext(file_entry['pdf_filename'])[0]}.txt"),
+                'cached_outputs': None,
+                'error': None,
+            }
+            documents.append(document)
+            try:
+                with fitz.open(file_entry['pdf_path']) as doc:
+                    document['num_pages'] = doc.page_count
+            except Exception as e:
+                if not is_batch:
+                    raise
+                log_user_action(user_id, username, f"Could not open {file_entry['original_name']} in batch job {job_id}: {e}")
+                document['error'] = f"Could not open PDF: {e}"
+                continue
+            next_first_page += document['num_pages']
+
+            cached_outputs = find_cached_document(document['cache_key'])
+            if cached_outputs:
+                log_user_action(user_id, username, f"Found cached result for PDF: {file_entry['original_name']}. Skipping OCR.")
+                document['cached_outputs'] = restore_cached_document(cached_outputs, document['result_path'])
+                cached_files += 1
+        num_pages = next_first_page - 1
+
+        if num_pages == 0 and not is_batch:
              log_user_action(user_id, username, f"PDF {original_name} has 0 pages. Aborting.")
-             bot.send_message(message.chat.id, "הקובץ PDF ריק או פגום, לא ניתן לעבד.")
-             if doc: doc.close()
-             if user_id in processing_files: del processing_files[user_id]
+             bot.send_message(chat_id, "הקובץ PDF ריק או פגום, לא ניתן לעבד.")
+             job_error = "PDF has no pages"
              return
 
-        log_user_action(user_id, username, f"PDF has {num_pages} pages. Submitting tasks to pool (Max workers: {MAX_OCR_WORKERS})...")
-        
-        with ProcessPoolExecutor(max_workers=MAX_OCR_WORKERS) as executor:
-            for i in range(num_pages):
-                page = doc.load_page(i)
-                pix = page.get_pixmap(dpi=300)
-                img_bytes = pix.tobytes("png")
-                
-                if not img_bytes:
-                     log_user_action(user_id, username, f"Warning: Could not get image bytes for page {i+1}")
-                     page_results_dict[i + 1] = f"--- Error getting image for page {i + 1} ---"
-                     continue
-
-                future = executor.submit(
-                    process_page_ocr,
-                    i,
-                    img_bytes,
-                    language,
-                    rotation_angle,
-                    EFFECTIVE_TESSERACT_CMD
-                )
-                page_submission_futures[future] = i + 1
-
-            doc.close()
-            doc = None
-            log_user_action(user_id, username, f"Submitted {len(page_submission_futures)} pages. Waiting for completion...")
-
-            processed_count = 0
-            total_tasks = len(page_submission_futures)
-            for future in as_completed(page_submission_futures):
-                page_num_1_based = page_submission_futures[future]
-                try:
-                    _returned_page_num, text_content = future.result()
-                    page_results_dict[page_num_1_based] = text_content
-                except Exception as exc:
-                    log_user_action(user_id, username, f'Error processing page {page_num_1_based} (future result): {exc}\n{traceback.format_exc()}')
-                    page_results_dict[page_num_1_based] = f"--- Error processing page {page_num_1_based}: {exc} ---"
-                
-                processed_count += 1
-                if processed_count % 5 == 0 or processed_count == total_tasks:
-                     progress = (processed_count / total_tasks) * 100
-                     log_user_action(user_id, username, f"OCR Processing progress: {processed_count}/{total_tasks} pages ({progress:.1f}%)")
-
-
-        log_user_action(user_id, username, "All pages processed by pool. Assembling final text file.")
-        with open(result_file_path, 'w', encoding='utf-8') as combined_file:
-            for i in range(1, num_pages + 1):
-                page_text = page_results_dict.get(i, f"--- Text for page {i} was not processed or result missing ---")
-                combined_file.write(f"\n\n===== PAGE {i} =====\n\n")
-                combined_file.write(page_text)
+        page_plan = [
+            (document, page_index)
+            for document in documents if document['cached_outputs'] is None and document['error'] is None
+            for page_index in range(document['num_pages'])
+        ]
+        resumed_pages = sum(1 for document, page_index in page_plan if document['first_page'] + page_index in page_results_dict)
+        stale_pages = len(page_results_dict) - resumed_pages
+        metrics.inc('pages_total', resumed_pages, source='resumed')
 
-        log_user_action(user_id, username, f"Processing complete. Sending result file: {result_file_path}")
-        with open(result_file_path, 'rb') as txt_file_to_send:
-            bot.send_document(message.chat.id, txt_file_to_send, caption=f"טקסט שחולץ מתוך: {original_name}.txt")
+        text_layer_pages = 0
+        cached_pages = 0
+        blank_pages = 0
+        if page_plan:
+            bot.send_chat_action(chat_id, 'upload_document')
+            if resumed_pages:
+                log_user_action(user_id, username, f"Resuming job {job_id} with {resumed_pages}/{len(page_plan)} pages already completed.")
+                bot.send_message(chat_id, f"ממשיך את עיבוד הקובץ {original_name} מהנקודה שבה נעצר ({resumed_pages}/{len(page_plan)} עמודים כבר עובדו).")
+
+            log_user_action(user_id, username, f"Job has {len(page_plan)} pages to process in {len(job_files) - cached_files} files. Submitting tasks to shared pool (Max workers: {MAX_OCR_WORKERS})...")
+
+            status_message = StatusMessage(chat_id, len(page_plan), user_id, username)
+            status_message.start(resumed_pages)
+
+            next_plan_index = 0
+            open_document = None
+            object_hashes = {}
+            pages_since_open = 0
+            last_logged_count = 0
+            contiguous_pages = 0
+            while contiguous_pages + 1 in page_results_dict:
+                contiguous_pages += 1
+            last_partial_page = contiguous_pages
+            while next_plan_index < len(page_plan) or page_submission_futures:
+                while next_plan_index < len(page_plan) and len(page_submission_futures) < RENDER_AHEAD_PAGES:
+                    document, page_index = page_plan[next_plan_index]
+                    next_plan_index += 1
+                    page_num = document['first_page'] + page_index
+                    if page_num in page_results_dict:
+                        continue
+
+                    if document is not open_document or pages_since_open >= PDF_CHUNK_PAGES:
+                        if open_doc is not None:
+                            open_doc.close()
+                            fitz.TOOLS.store_shrink(100)
+                        open_doc = fitz.open(document['file']['pdf_path'])
+                        if document is not open_document:
+                            object_hashes = {}
+                        open_document = document
+                        pages_since_open = 0
+                    pages_since_open += 1
+                    page = open_doc.load_page(page_index)
+                    if USE_TEXT_LAYER:
+                        native_text = extract_text_layer(page, language)
+                        if native_text is not None:
+                            page_results_dict[page_num] = native_text
+                            job_store.save_page(job_id, page_num, native_text, text_layer_layout(page) if CAPTURE_LAYOUT else None)
+                            text_layer_pages += 1
+                            metrics.inc('pages_total', source='text_layer')
+                            continue
+
+                    page_hash = hash_page(page, object_hashes)
+                    page_cache_key = result_cache.make_key(page_hash, language, rotation_key)
+                    cached_text = result_cache.get('pages', page_cache_key)
+                    cached_layout = result_cache.get('layouts', page_cache_key) if CAPTURE_LAYOUT else None
+                    if cached_text is not None and (cached_layout is not None or not CAPTURE_LAYOUT):
+                        page_results_dict[page_num] = cached_text
+                        job_store.save_page(job_id, page_num, cached_text, json.loads(cached_layout) if cached_layout else None)
+                        cached_pages += 1
+                        metrics.inc('pages_total', source='cache')
+                        continue
+
+                    page_rotation = rotation_angle
+                    if page_rotation is None:
+                        cached_rotation = result_cache.get('orientations', page_hash)
+                        if cached_rotation is not None:
+                            page_rotation = int(cached_rotation)
+
+                    page_rect = list(page.rect)
+                    if RENDER_IN_WORKER:
+                        if document['file']['pdf_path'] not in published_documents:
+                            with metrics.span('publish', job_id=job_id):
+                                ocr_scheduler.executor.publish_document(document['file']['pdf_path'], document['file']['file_hash'])
+                            published_documents.add(document['file']['pdf_path'])
+                        page_geometry[page_num] = (None, None, page_rect)
+                        future = ocr_scheduler.submit(
+                            user_id,
+                            render_and_ocr_page,
+                            document['file']['pdf_path'],
+                            page_index,
+                            language,
+                            page_rotation,
+                            OCR_QUALITY,
+                            OCR_OPTIONS,
+                            job_id=job_id,
+                            page=page_num
+                        )
+                    else:
+                        render_start = time.perf_counter()
+                        render_plan = result_cache.get('render_plans', make_render_plan_key(page_hash))
+                        if render_plan is not None:
+                            render_dpi, render_clip = json.loads(render_plan)
+                            render_clip = fitz.Rect(render_clip) if render_clip is not None else None
+                        else:
+                            render_dpi, render_clip = plan_page_render(page, OCR_QUALITY)
+                        if render_dpi is None:
+                            page_results_dict[page_num] = ""
+                            job_store.save_page(job_id, page_num, "", empty_page_layout(page_rect) if CAPTURE_LAYOUT else None)
+                            blank_pages += 1
+                            metrics.inc('pages_total', source='blank')
+                            continue
+
+                        img_bytes, width, height = render_page_for_ocr(page, render_dpi, render_clip)
+                        page_geometry[page_num] = (render_dpi, list(render_clip) if render_clip is not None else None, page_rect)
+                        metrics.record_span('render', time.perf_counter() - render_start, job_id=job_id, page=page_num)
+
+                        if not img_bytes:
+                             log_user_action(user_id, username, f"Warning: Could not get image bytes for page {page_num}")
+                             page_results_dict[page_num] = f"--- Error getting image for page {page_index + 1} ---"
+                             failed_pages.add(page_num)
+                             metrics.inc('page_errors_total')
+                             continue
+
+                        future = ocr_scheduler.submit(
+                            user_id,
+                            process_page_ocr,
+                            page_index,
+                            img_bytes,
+                            width,
+                            height,
+                            language,
+                            page_rotation,
+                            OCR_OPTIONS,
+                            job_id=job_id,
+                            page=page_num
+                        )
+                    page_submission_futures[future] = page_num
+                    page_hashes[page_num] = page_hash
+
+                done_futures = []
+                if page_submission_futures:
+                    done_futures, _ = wait(page_submission_futures, return_when=FIRST_COMPLETED)
+                for future in done_futures:
+                    page_num = page_submission_futures.pop(future)
+                    render_dpi, render_clip, page_rect = page_geometry.pop(page_num)
+                    try:
+                        _returned_page_num, text_content, detected_rotation, page_timings, ocr_layout = future.result()
+                        page_results_dict[page_num] = text_content
+                        for stage, stage_seconds in page_timings.items():
+                            metrics.record_span(stage, stage_seconds, job_id=job_id, page=page_num)
+                        page_hash = page_hashes[page_num]
+                        if rotation_angle is None and detected_rotation is not None:
+                            result_cache.put('orientations', page_hash, str(detected_rotation))
+                        if is_error_result(text_content):
+                            failed_pages.add(page_num)
+                            metrics.inc('page_errors_total')
+                        elif ocr_layout is not None and ocr_layout.get('dpi', render_dpi) is None:
+                            job_store.save_page(job_id, page_num, text_content, empty_page_layout(page_rect) if CAPTURE_LAYOUT else None)
+                            blank_pages += 1
+                            metrics.inc('pages_total', source='blank')
+                        else:
+                            metrics.inc('pages_total', source='ocr')
+                            page_layout = None
+                            if ocr_layout is not None:
+                                page_layout = ocr_layout_to_page(ocr_layout, ocr_layout.get('dpi', render_dpi), ocr_layout.get('clip', render_clip), page_rect)
+                            elif CAPTURE_LAYOUT:
+                                page_layout = empty_page_layout(page_rect)
+                            page_cache_key = result_cache.make_key(page_hash, language, rotation_key)
+                            result_cache.put('pages', page_cache_key, text_content)
+                            if page_layout is not None:
+                                result_cache.put('layouts', page_cache_key, json.dumps(page_layout, ensure_ascii=False))
+                            job_store.save_page(job_id, page_num, text_content, page_layout)
+                    except Exception as exc:
+                        log_user_action(user_id, username, f'Error processing page {page_num} (future result): {exc}\n{traceback.format_exc()}')
+                        page_results_dict[page_num] = f"--- Error processing page {page_num}: {exc} ---"
+                        failed_pages.add(page_num)
+                        metrics.inc('page_errors_total')
+
+                processed_count = len(page_results_dict) - stale_pages
+                if processed_count - last_logged_count >= 5 or processed_count == len(page_plan):
+                     last_logged_count = processed_count
+                     progress = (processed_count / len(page_plan)) * 100
+                     log_user_action(user_id, username, f"OCR Processing progress: {processed_count}/{len(page_plan)} pages ({progress:.1f}%)")
+                status_message.update(processed_count)
+
+                while contiguous_pages + 1 in page_results_dict:
+                    contiguous_pages += 1
+                if PARTIAL_RESULT_PAGES > 0 and not is_batch and contiguous_pages < num_pages and contiguous_pages - last_partial_page >= PARTIAL_RESULT_PAGES:
+                    partial_file_path = os.path.join(results_dir, f'{pdf_filename_base}_pages_{last_partial_page + 1}-{contiguous_pages}.txt')
+                    write_pages_text(partial_file_path, page_results_dict, last_partial_page + 1, contiguous_pages)
+                    log_user_action(user_id, username, f"Sending partial result for pages {last_partial_page + 1}-{contiguous_pages}.")
+                    with metrics.span('send', job_id=job_id), open(partial_file_path, 'rb') as partial_file:
+                        bot.send_document(chat_id, partial_file, caption=f"טקסט חלקי מתוך {original_name}: עמודים {last_partial_page + 1}-{contiguous_pages}")
+                    last_partial_page = contiguous_pages
+
+            status_message.update(len(page_plan), force=True)
+            if open_doc is not None:
+                open_doc.close()
+                open_doc = None
+            log_user_action(user_id, username, f"Extracted {text_layer_pages} pages from the embedded text layer, {cached_pages} pages from the cache and {len(page_plan) - resumed_pages - text_layer_pages - cached_pages - blank_pages} pages with OCR. Skipped {blank_pages} blank pages and resumed {resumed_pages} pages from the job checkpoint.")
+
+        log_user_action(user_id, username, "All pages processed by pool. Assembling result files.")
+        file_results = []
+        for document in documents:
+            if document['cached_outputs']:
+                file_results.append((document['file']['original_name'], document['cached_outputs']))
+                continue
+            if document['num_pages'] == 0:
+                with open(document['result_path'], 'w', encoding='utf-8') as result_file:
+                    result_file.write(f"--- {document['error'] or 'PDF has no pages'} ---")
+                file_results.append((document['file']['original_name'], {'txt': document['result_path']}))
+                continue
+            outputs = write_document_outputs(job_id, document, page_results_dict, language)
+            file_results.append((document['file']['original_name'], outputs))
+            last_page = document['first_page'] + document['num_pages'] - 1
+            if not any(document['first_page'] <= page_num <= last_page for page_num in failed_pages):
+                for output_format, output_path in outputs.items():
+                    result_cache.put_file('documents', make_document_output_key(document['cache_key'], output_format), output_path)
+        evicted = result_cache.evict()
+        if evicted:
+            log_user_action(user_id, username, f"Evicted {evicted} entries from the result cache.")
+
+        send_result_files(chat_id, collect_result_files(results_dir, pdf_filename_base, original_name, file_results), user_id, username, job_id)
 
         end_time = datetime.now()
         duration = end_time - start_time
-        log_user_action(user_id, username, f"Successfully completed processing PDF '{original_name}' in {duration}.")
-        bot.send_message(message.chat.id, "✅ עיבוד הקובץ הושלם!")
+        log_user_action(user_id, username, f"Successfully completed processing job {job_id} ({original_name}) in {duration}.")
+        bot.send_message(chat_id, "✅ עיבוד הקובץ הושלם!")
+        job_state = JOB_DONE
 
     except fitz.fitz.FileNotFoundError:
-         log_user_action(user_id, username, f"Error: PDF file not found at path during processing: {pdf_path}")
-         bot.send_message(message.chat.id, "שגיאה: קובץ ה-PDF המקורי נמחק או הועבר לפני שהעיבוד הסתיים.")
+         log_user_action(user_id, username, f"Error: PDF file not found at path during processing: {job_files[0]['pdf_path']}")
+         job_error = "PDF file not found"
+         bot.send_message(chat_id, "שגיאה: קובץ ה-PDF המקורי נמחק או הועבר לפני שהעיבוד הסתיים.")
     except Exception as e:
         log_user_action(user_id, username, f"Fatal error during parallel PDF processing: {str(e)}\n{traceback.format_exc()}")
-        bot.send_message(message.chat.id, f"❌ אירעה שגיאה חמורה במהלך עיבוד הקובץ: {str(e)}")
+        job_error = str(e)
+        bot.send_message(chat_id, f"❌ אירעה שגיאה חמורה במהלך עיבוד הקובץ: {str(e)}")
     finally:
-        if doc:
-            doc.close()
-        if user_id in processing_files:
-            del processing_files[user_id]
-        log_user_action(user_id, username, "Cleaned up processing state for user.")
+        if open_doc is not None:
+            open_doc.close()
+        for pdf_path in published_documents:
+            ocr_scheduler.executor.release_document(pdf_path)
+        job_store.finish_job(job_id, job_state, job_error)
+        metrics.inc('jobs_total', state=job_state)
+        metrics.observe('job_seconds', time.perf_counter() - job_start)
+        log_user_action(user_id, username, f"Job {job_id} finished with state '{job_state}'.")
 
 
 if __name__ == "__main__":
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Bot starting...")
+    if RENDER_IN_WORKER:
+        ocr_broker = create_broker(OCR_BROKER, config)
+        if OCR_BROKER == 'inprocess':
+            start_inprocess_workers(ocr_broker, OCR_OPTIONS, os.path.join(BASE_DIR, "worker_documents"), MAX_OCR_WORKERS)
+        ocr_scheduler = OcrScheduler(BROKER_MAX_IN_FLIGHT_PAGES, lambda: BrokerExecutor(ocr_broker))
+        print(f"Dispatching OCR pages through the '{OCR_BROKER}' broker (Max in flight: {BROKER_MAX_IN_FLIGHT_PAGES}).")
+    else:
+        ocr_scheduler = OcrScheduler(MAX_OCR_WORKERS)
+    job_store = JobStore(JOBS_DB_PATH)
+    requeued_jobs = job_store.requeue_interrupted_jobs()
+    if requeued_jobs:
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Re-queued {requeued_jobs} interrupted jobs.")
+    job_dispatcher = JobDispatcher(job_store, process_pdf_parallel, MAX_CONCURRENT_JOBS)
+    job_dispatcher.start()
+    metrics.gauge('active_jobs', "Jobs that are queued or running.", job_store.count_active_jobs)
+    metrics.gauge('ocr_queued_pages', "Pages waiting in the fair-share OCR scheduler.", ocr_scheduler.queued_tasks)
+    metrics.gauge('ocr_worker_utilization', "Fraction of OCR worker slots that are busy.", lambda: ocr_scheduler.in_flight / ocr_scheduler.max_workers)
+    if METRICS_PORT:
+        start_metrics_server(metrics, METRICS_HOST, METRICS_PORT)
+        print(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
     
     while True:
         try:
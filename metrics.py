@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    formatted = []
+    for name, value in labels:
+        escaped = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        formatted.append(f'{name}="{escaped}"')
+    return "{" + ",".join(formatted) + "}"
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    def __init__(self, namespace='pdftextify', trace_path=None):
+        self.namespace = namespace
+        self.trace_path = trace_path
+        self.lock = threading.Lock()
+        self.trace_lock = threading.Lock()
+        self.metric_types = {}
+        self.help_texts = {}
+        self.buckets = {}
+        self.values = {}
+        self.histograms = {}
+        self.callbacks = {}
+
+    def _name(self, name):
+        return f"{self.namespace}_{name}"
+
+    def counter(self, name, help_text):
+        self.metric_types[self._name(name)] = 'counter'
+        self.help_texts[self._name(name)] = help_text
+
+    def gauge(self, name, help_text, callback=None):
+        self.metric_types[self._name(name)] = 'gauge'
+        self.help_texts[self._name(name)] = help_text
+        if callback is not None:
+            self.callbacks[self._name(name)] = callback
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.metric_types[self._name(name)] = 'histogram'
+        self.help_texts[self._name(name)] = help_text
+        self.buckets[self._name(name)] = tuple(buckets)
+
+    def inc(self, name, amount=1, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        full_name = self._name(name)
+        key = (full_name, tuple(sorted(labels.items())))
+        buckets = self.buckets[full_name]
+        with self.lock:
+            bucket_counts, total = self.histograms.get(key, ([0] * len(buckets), 0.0))
+            for bucket_index, upper_bound in enumerate(buckets):
+                if value <= upper_bound:
+                    bucket_counts[bucket_index] += 1
+            self.histograms[key] = (bucket_counts, total + value)
+            self.values[key] = self.values.get(key, 0) + 1
+
+    def record_span(self, stage, seconds, **attributes):
+        self.observe('stage_seconds', seconds, stage=stage)
+        if not self.trace_path:
+            return
+        span = {'time': datetime.now().isoformat(timespec='milliseconds'), 'stage': stage, 'seconds': round(seconds, 6)}
+        span.update(attributes)
+        line = json.dumps(span, ensure_ascii=False)
+        with self.trace_lock:
+            with open(self.trace_path, 'a', encoding='utf-8') as trace_file:
+                trace_file.write(line + "\n")
+
+    @contextmanager
+    def span(self, stage, **attributes):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(stage, time.perf_counter() - start_time, **attributes)
+
+    def render(self):
+        callback_values = {}
+        for name, callback in self.callbacks.items():
+            try:
+                callback_values[name] = callback()
+            except Exception:
+                continue
+
+        with self.lock:
+            values = dict(self.values)
+            histograms = {key: (list(bucket_counts), total) for key, (bucket_counts, total) in self.histograms.items()}
+
+        lines = []
+        for name in sorted(self.metric_types):
+            metric_type = self.metric_types[name]
+            lines.append(f"# HELP {name} {self.help_texts[name]}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if name in callback_values:
+                lines.append(f"{name} {format_value(callback_values[name])}")
+                continue
+            for (value_name, labels), value in sorted(values.items()):
+                if value_name != name:
+                    continue
+                if metric_type != 'histogram':
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                    continue
+                bucket_counts, total = histograms[(value_name, labels)]
+                for upper_bound, bucket_count in zip(self.buckets[name], bucket_counts):
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', format_value(float(upper_bound))),))} {bucket_count}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {value}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(total)}")
+                lines.append(f"{name}_count{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(registry, host, port):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
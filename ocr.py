@@ -0,0 +1,448 @@
+import fitz
+import pytesseract
+from PIL import Image, ImageOps
+import os
+import re
+import subprocess
+import threading
+import time
+import traceback
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+OCR_DPI = 300
+OSD_TARGET_SHORT_SIDE = 1240
+OSD_MIN_CONFIDENCE = 2.0
+TEXT_LAYER_MIN_CHARS = 20
+TEXT_LAYER_MIN_VALID_RATIO = 0.9
+TEXT_LAYER_MIN_COVERAGE = 0.5
+ANALYSIS_DPI = 100
+INK_THRESHOLD = 254
+MIN_LINE_HEIGHT_PX = 2
+MAX_LINE_HEIGHT_PX = ANALYSIS_DPI // 2
+BORDER_MAX_RATIO = 0.15
+BORDER_INK_VALUE = 128
+BORDER_MARGIN_RATIO = 0.02
+CONTENT_MARGIN_RATIO = 0.02
+TESSERACT_TIMEOUT_SECONDS = 300
+RENDER_PRESETS = {
+    'fixed': None,
+    'fast': {'target_line_px': 30, 'min_dpi': 150, 'max_dpi': 300},
+    'balanced': {'target_line_px': 40, 'min_dpi': 200, 'max_dpi': 300},
+    'quality': {'target_line_px': 50, 'min_dpi': 300, 'max_dpi': 400},
+}
+LANGUAGE_CHAR_RANGES = {
+    'heb': [(0x0590, 0x05FF), (0xFB1D, 0xFB4F)],
+    'eng': [],
+    'rus': [(0x0400, 0x04FF)],
+}
+
+
+def rotate_image(img, angle):
+    if angle == 0:
+        return img
+    return img.rotate(angle, expand=True)
+
+def otsu_threshold(histogram):
+    total = sum(histogram)
+    sum_total = sum(value * count for value, count in enumerate(histogram))
+    sum_background = 0
+    weight_background = 0
+    best_threshold = 128
+    best_variance = 0
+    for value, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += value * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_total - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = value + 1
+    return best_threshold
+
+def enhance_image_for_ocr(image):
+    if image.mode != 'L':
+        image = image.convert('L')
+    threshold = otsu_threshold(image.histogram())
+    return image.point([0 if value < threshold else 255 for value in range(256)])
+
+def osd_to_pil_angle(clockwise_rotation, confidence):
+    if confidence < OSD_MIN_CONFIDENCE:
+        return 0
+    return (360 - clockwise_rotation) % 360
+
+def ink_runs(profile):
+    runs = []
+    run_start = None
+    for index, value in enumerate(profile):
+        if value < INK_THRESHOLD and run_start is None:
+            run_start = index
+        elif value >= INK_THRESHOLD and run_start is not None:
+            runs.append((run_start, index))
+            run_start = None
+    if run_start is not None:
+        runs.append((run_start, len(profile)))
+    return runs
+
+def trim_dark_edges(profile):
+    length = len(profile)
+    limit = int(length * BORDER_MAX_RATIO)
+    margin = int(length * BORDER_MARGIN_RATIO)
+    start = 0
+    while start < limit and profile[start] < BORDER_INK_VALUE:
+        start += 1
+    end = length
+    while length - end < limit and profile[end - 1] < BORDER_INK_VALUE:
+        end -= 1
+    if start:
+        start += margin
+    if end < length:
+        end -= margin
+    return start, end
+
+def render_analysis_image(page):
+    pix = page.get_pixmap(dpi=ANALYSIS_DPI, colorspace=fitz.csGRAY, alpha=False)
+    return image_from_samples(pix.samples, pix.width, pix.height)
+
+def plan_page_render(page, preset_name, analysis_image=None):
+    preset = RENDER_PRESETS[preset_name]
+    if preset is None:
+        return OCR_DPI, None
+
+    if analysis_image is None:
+        analysis_image = render_analysis_image(page)
+    img = enhance_image_for_ocr(analysis_image)
+    left, right = trim_dark_edges(list(img.resize((img.width, 1), Image.BOX).getdata()))
+    top, bottom = trim_dark_edges(list(img.resize((1, img.height), Image.BOX).getdata()))
+    if right <= left or bottom <= top:
+        return preset['max_dpi'], None
+    content_bbox = ImageOps.invert(img.crop((left, top, right, bottom))).getbbox()
+    if content_bbox is None:
+        return None, None
+    content_bbox = (content_bbox[0] + left, content_bbox[1] + top, content_bbox[2] + left, content_bbox[3] + top)
+
+    content_img = img.crop(content_bbox)
+    row_profile = content_img.resize((1, content_img.height), Image.BOX).getdata()
+    line_heights = sorted(
+        end - start for start, end in ink_runs(row_profile) if MIN_LINE_HEIGHT_PX <= end - start <= MAX_LINE_HEIGHT_PX
+    )
+    dpi = preset['max_dpi']
+    if line_heights:
+        median_line_height = line_heights[len(line_heights) // 2]
+        dpi = ANALYSIS_DPI * preset['target_line_px'] / median_line_height
+        dpi = int(min(max(dpi, preset['min_dpi']), preset['max_dpi']) // 10 * 10)
+
+    clip = None
+    if page.rotation == 0:
+        page_rect = page.rect
+        scale = 72 / ANALYSIS_DPI
+        margin = CONTENT_MARGIN_RATIO * max(page_rect.width, page_rect.height)
+        left, top, right, bottom = content_bbox
+        clip = fitz.Rect(
+            page_rect.x0 + left * scale - margin, page_rect.y0 + top * scale - margin,
+            page_rect.x0 + right * scale + margin, page_rect.y0 + bottom * scale + margin
+        ) & page_rect
+    return dpi, clip
+
+def render_page_for_ocr(page, dpi=OCR_DPI, clip=None):
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False, clip=clip)
+    return pix.samples, pix.width, pix.height
+
+def image_from_samples(image_bytes, width, height):
+    return Image.frombuffer('L', (width, height), image_bytes, 'raw', 'L', 0, 1)
+
+def words_to_text(words):
+    lines = []
+    previous_key = None
+    for word in words:
+        key = (word['block'], word['par'], word['line'])
+        if previous_key is not None and key[:2] != previous_key[:2]:
+            lines.append("")
+        if key != previous_key:
+            lines.append(word['text'])
+        else:
+            lines[-1] += " " + word['text']
+        previous_key = key
+    return "\n".join(lines)
+
+def parse_tesseract_tsv(tsv_output):
+    words = []
+    for row in tsv_output.splitlines()[1:]:
+        columns = row.split('\t')
+        if len(columns) < 12 or columns[0] != '5' or not columns[11].strip():
+            continue
+        left, top, width, height = (int(value) for value in columns[6:10])
+        words.append({
+            'text': columns[11],
+            'conf': round(float(columns[10]), 2),
+            'bbox': [left, top, left + width, top + height],
+            'block': int(columns[2]),
+            'par': int(columns[3]),
+            'line': int(columns[4]),
+        })
+    return words
+
+class TesseractCliBackend:
+    name = 'cli'
+
+    def __init__(self, tesseract_cmd=None, tessdata_path=None):
+        self.tesseract_cmd = tesseract_cmd or pytesseract.pytesseract.tesseract_cmd
+        self.tessdata_path = tessdata_path
+
+    def _run(self, arguments, image, config_files=()):
+        header = f"P5\n{image.width} {image.height}\n255\n".encode('ascii')
+        command = [self.tesseract_cmd, 'stdin', 'stdout'] + arguments
+        if self.tessdata_path:
+            command += ['--tessdata-dir', self.tessdata_path]
+        command += list(config_files)
+        subprocess_kwargs = pytesseract.pytesseract.subprocess_args()
+        del subprocess_kwargs['stdin']
+        return subprocess.run(command, input=header + image.tobytes(), timeout=TESSERACT_TIMEOUT_SECONDS, **subprocess_kwargs)
+
+    def _recognize(self, image, language, config_files=()):
+        result = self._run(['-l', language, '--oem', '3', '--psm', '6'], image, config_files)
+        if result.returncode != 0:
+            raise pytesseract.TesseractError(result.returncode, result.stderr.decode('utf-8', errors='replace'))
+        return result.stdout.decode('utf-8')
+
+    def image_to_text(self, image, language):
+        return self._recognize(image, language)
+
+    def image_to_data(self, image, language):
+        words = parse_tesseract_tsv(self._recognize(image, language, ['tsv']))
+        return words_to_text(words), words
+
+    def detect_rotation(self, image):
+        result = self._run(['--psm', '0'], image)
+        output = result.stdout.decode('utf-8', errors='replace')
+        rotate_match = re.search(r'Rotate: (\d+)', output)
+        confidence_match = re.search(r'Orientation confidence: ([\d.]+)', output)
+        if result.returncode != 0 or not rotate_match or not confidence_match:
+            return 0
+        return osd_to_pil_angle(int(rotate_match.group(1)), float(confidence_match.group(1)))
+
+
+class TesserocrBackend:
+    name = 'tesserocr'
+
+    def __init__(self, tesseract_cmd=None, tessdata_path=None):
+        if tesserocr is None:
+            raise RuntimeError("tesserocr is not installed")
+        if not tessdata_path and tesseract_cmd and os.path.isabs(tesseract_cmd):
+            bundled_tessdata = os.path.join(os.path.dirname(tesseract_cmd), 'tessdata')
+            if os.path.isdir(bundled_tessdata):
+                tessdata_path = bundled_tessdata
+        self.tessdata_path = tessdata_path
+        self.apis = {}
+        self.osd_api = None
+        self.fallback = TesseractCliBackend(tesseract_cmd, tessdata_path)
+        self.fallback_languages = set()
+
+    def get_api(self, language):
+        api = self.apis.get(language)
+        if api is None:
+            api_kwargs = {'lang': language, 'psm': tesserocr.PSM.SINGLE_BLOCK, 'oem': tesserocr.OEM.DEFAULT}
+            if self.tessdata_path:
+                api_kwargs['path'] = self.tessdata_path
+            api = tesserocr.PyTessBaseAPI(**api_kwargs)
+            self.apis[language] = api
+        return api
+
+    def image_to_text(self, image, language):
+        if language in self.fallback_languages:
+            return self.fallback.image_to_text(image, language)
+        try:
+            api = self.get_api(language)
+        except RuntimeError as e:
+            print(f"[Worker Warning] Could not initialize tesserocr for '{language}' ({e}). Falling back to the tesseract command line.")
+            self.fallback_languages.add(language)
+            return self.fallback.image_to_text(image, language)
+        api.SetImage(image)
+        return api.GetUTF8Text()
+
+    def image_to_data(self, image, language):
+        if language in self.fallback_languages:
+            return self.fallback.image_to_data(image, language)
+        try:
+            api = self.get_api(language)
+        except RuntimeError as e:
+            print(f"[Worker Warning] Could not initialize tesserocr for '{language}' ({e}). Falling back to the tesseract command line.")
+            self.fallback_languages.add(language)
+            return self.fallback.image_to_data(image, language)
+        api.SetImage(image)
+        api.Recognize()
+        words = []
+        block = par = line = 0
+        for word_iterator in tesserocr.iterate_level(api.GetIterator(), tesserocr.RIL.WORD):
+            if word_iterator.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                block += 1
+            if word_iterator.IsAtBeginningOf(tesserocr.RIL.PARA):
+                par += 1
+            if word_iterator.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                line += 1
+            word_text = word_iterator.GetUTF8Text(tesserocr.RIL.WORD)
+            bounding_box = word_iterator.BoundingBox(tesserocr.RIL.WORD)
+            if not word_text or not word_text.strip() or bounding_box is None:
+                continue
+            words.append({
+                'text': word_text,
+                'conf': round(word_iterator.Confidence(tesserocr.RIL.WORD), 2),
+                'bbox': list(bounding_box),
+                'block': block,
+                'par': par,
+                'line': line,
+            })
+        return api.GetUTF8Text(), words
+
+    def detect_rotation(self, image):
+        if self.osd_api is None:
+            api_kwargs = {'lang': 'osd', 'psm': tesserocr.PSM.OSD_ONLY}
+            if self.tessdata_path:
+                api_kwargs['path'] = self.tessdata_path
+            try:
+                self.osd_api = tesserocr.PyTessBaseAPI(**api_kwargs)
+            except RuntimeError:
+                return self.fallback.detect_rotation(image)
+        self.osd_api.SetImage(image)
+        osd = self.osd_api.DetectOrientationScript()
+        if not osd:
+            return 0
+        return osd_to_pil_angle((360 - osd['orient_deg']) % 360, osd['orient_conf'])
+
+
+OCR_BACKENDS = {backend.name: backend for backend in [TesseractCliBackend, TesserocrBackend]}
+_worker_backends = threading.local()
+
+def resolve_ocr_backend_name(requested_backend):
+    if requested_backend == 'auto':
+        return 'tesserocr' if tesserocr is not None else 'cli'
+    if requested_backend not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend: {requested_backend}")
+    return requested_backend
+
+def get_ocr_backend(ocr_options=None):
+    ocr_options = ocr_options or {}
+    backend_name = resolve_ocr_backend_name(ocr_options.get('backend', 'auto'))
+    tesseract_cmd = ocr_options.get('tesseract_cmd')
+    tessdata_path = ocr_options.get('tessdata_path')
+    cache_key = (backend_name, tesseract_cmd, tessdata_path)
+    if not hasattr(_worker_backends, 'backends'):
+        _worker_backends.backends = {}
+    backend = _worker_backends.backends.get(cache_key)
+    if backend is None:
+        try:
+            backend = OCR_BACKENDS[backend_name](tesseract_cmd, tessdata_path)
+        except Exception as e:
+            print(f"[Worker Warning] Could not start the '{backend_name}' OCR backend ({e}). Falling back to the tesseract command line.")
+            backend = TesseractCliBackend(tesseract_cmd, tessdata_path)
+        _worker_backends.backends[cache_key] = backend
+    return backend
+
+def is_valid_text_char(char, language):
+    if char.isdigit() or (char.isascii() and char.isprintable()):
+        return True
+    if char in "–—‘’“”«»•…€₪№°":
+        return True
+    code_point = ord(char)
+    for range_start, range_end in LANGUAGE_CHAR_RANGES.get(language, []):
+        if range_start <= code_point <= range_end:
+            return True
+    return False
+
+def rect_area(bbox, page_rect):
+    clipped = fitz.Rect(bbox) & page_rect
+    if clipped.is_empty:
+        return 0.0
+    return clipped.width * clipped.height
+
+def extract_text_layer(page, language):
+    text = page.get_text("text")
+    visible_chars = [char for char in text if not char.isspace()]
+    if len(visible_chars) < TEXT_LAYER_MIN_CHARS:
+        return None
+
+    valid_chars = sum(1 for char in visible_chars if is_valid_text_char(char, language))
+    if valid_chars / len(visible_chars) < TEXT_LAYER_MIN_VALID_RATIO:
+        return None
+
+    page_rect = page.rect
+    text_area = sum(rect_area(block[:4], page_rect) for block in page.get_text("blocks") if block[6] == 0)
+    image_area = sum(rect_area(info['bbox'], page_rect) for info in page.get_image_info())
+    if text_area + image_area <= 0 or text_area / (text_area + image_area) < TEXT_LAYER_MIN_COVERAGE:
+        return None
+
+    return text.strip()
+
+def detect_page_rotation(backend, image):
+    try:
+        reduce_factor = max(1, min(image.width, image.height) // OSD_TARGET_SHORT_SIDE)
+        return backend.detect_rotation(image.reduce(reduce_factor))
+    except Exception as e:
+        print(f"[Worker Warning] Orientation detection failed ({e}). Assuming the page is upright.")
+        return 0
+
+def is_error_result(text):
+    return text.startswith("--- Error")
+
+def process_page_ocr(page_num, image_bytes, width, height, language, rotation_angle, ocr_options=None):
+    timings = {}
+    layout = None
+    try:
+        stage_start = time.perf_counter()
+        backend = get_ocr_backend(ocr_options)
+        img = image_from_samples(image_bytes, width, height)
+        if rotation_angle is None:
+            rotation_angle = detect_page_rotation(backend, img)
+            timings['orientation'] = time.perf_counter() - stage_start
+            stage_start = time.perf_counter()
+        rotated_img = rotate_image(img, rotation_angle)
+        enhanced_img = enhance_image_for_ocr(rotated_img)
+        timings['preprocess'] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        if (ocr_options or {}).get('capture_layout'):
+            text, words = backend.image_to_data(enhanced_img, language)
+            layout = {'image_width': enhanced_img.width, 'image_height': enhanced_img.height, 'rotation': rotation_angle, 'words': words}
+        else:
+            text = backend.image_to_text(enhanced_img, language)
+        timings['ocr'] = time.perf_counter() - stage_start
+        return page_num + 1, text.strip(), rotation_angle, timings, layout
+    except Exception as e:
+        tb_str = traceback.format_exc()
+        print(f"[Worker Error] Page {page_num + 1}: Failed OCR processing - {e}\n{tb_str}")
+        return page_num + 1, f"--- Error processing page {page_num + 1} ---", rotation_angle, timings, layout
+
+def render_and_ocr_page(pdf_path, page_index, language, rotation_angle, quality, ocr_options=None):
+    timings = {}
+    try:
+        stage_start = time.perf_counter()
+        doc = fitz.open(pdf_path)
+        try:
+            page = doc.load_page(page_index)
+            dpi, clip = plan_page_render(page, quality)
+            if dpi is None:
+                timings['render'] = time.perf_counter() - stage_start
+                return page_index + 1, "", rotation_angle, timings, {'dpi': None, 'clip': None}
+            image_bytes, width, height = render_page_for_ocr(page, dpi, clip)
+        finally:
+            doc.close()
+        timings['render'] = time.perf_counter() - stage_start
+    except Exception as e:
+        tb_str = traceback.format_exc()
+        print(f"[Worker Error] Page {page_index + 1}: Failed to render page - {e}\n{tb_str}")
+        return page_index + 1, f"--- Error rendering page {page_index + 1} ---", rotation_angle, timings, None
+    page_num, text, rotation_angle, ocr_timings, layout = process_page_ocr(page_index, image_bytes, width, height, language, rotation_angle, ocr_options)
+    timings.update(ocr_timings)
+    if layout is not None:
+        layout['dpi'] = dpi
+        layout['clip'] = list(clip) if clip is not None else None
+    return page_num, text, rotation_angle, timings, layout
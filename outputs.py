@@ -0,0 +1,180 @@
+import html
+import json
+import os
+import shutil
+
+import fitz
+
+OUTPUT_SUFFIXES = {'txt': '.txt', 'pdf': '_searchable.pdf', 'hocr': '.hocr', 'json': '.json'}
+TEXT_LAYER_CONFIDENCE = 100.0
+BASELINE_RATIO = 0.2
+
+
+def unrotate_box(bbox, rotation_angle, rotated_width, rotated_height):
+    x0, y0, x1, y1 = bbox
+    if rotation_angle in (90, 270):
+        original_width, original_height = rotated_height, rotated_width
+    else:
+        original_width, original_height = rotated_width, rotated_height
+    if rotation_angle == 90:
+        return original_width - y1, x0, original_width - y0, x1
+    if rotation_angle == 180:
+        return original_width - x1, original_height - y1, original_width - x0, original_height - y0
+    if rotation_angle == 270:
+        return y0, original_height - x1, y1, original_height - x0
+    return x0, y0, x1, y1
+
+def empty_page_layout(page_rect, source='blank'):
+    return {'width': round(page_rect[2] - page_rect[0], 2), 'height': round(page_rect[3] - page_rect[1], 2), 'source': source, 'words': []}
+
+def ocr_layout_to_page(layout, dpi, clip, page_rect):
+    page_layout = empty_page_layout(page_rect, 'ocr')
+    scale = 72 / dpi
+    origin_x = (clip[0] if clip else page_rect[0]) - page_rect[0]
+    origin_y = (clip[1] if clip else page_rect[1]) - page_rect[1]
+    for word in layout['words']:
+        x0, y0, x1, y1 = unrotate_box(word['bbox'], layout['rotation'] or 0, layout['image_width'], layout['image_height'])
+        page_word = dict(word)
+        page_word['bbox'] = [
+            round(origin_x + x0 * scale, 2), round(origin_y + y0 * scale, 2),
+            round(origin_x + x1 * scale, 2), round(origin_y + y1 * scale, 2)
+        ]
+        page_layout['words'].append(page_word)
+    return page_layout
+
+def text_layer_layout(page):
+    page_layout = empty_page_layout(page.rect, 'text_layer')
+    rotation_matrix = page.rotation_matrix
+    for x0, y0, x1, y1, word_text, block, line, _word in page.get_text("words"):
+        bbox = fitz.Rect(x0, y0, x1, y1) * rotation_matrix
+        page_layout['words'].append({
+            'text': word_text,
+            'conf': TEXT_LAYER_CONFIDENCE,
+            'bbox': [round(bbox.x0, 2), round(bbox.y0, 2), round(bbox.x1, 2), round(bbox.y1, 2)],
+            'block': block,
+            'par': block,
+            'line': line,
+        })
+    return page_layout
+
+
+class JsonOutputWriter:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write('{"pages": [\n')
+        self.pages_written = 0
+
+    def write_page(self, page_num, text, layout):
+        page_data = {'page': page_num, 'text': text}
+        if layout is not None:
+            page_data.update({'width': layout['width'], 'height': layout['height'], 'source': layout['source'], 'words': layout['words']})
+        if self.pages_written:
+            self.file.write(',\n')
+        self.file.write(json.dumps(page_data, ensure_ascii=False))
+        self.pages_written += 1
+
+    def close(self):
+        self.file.write('\n]}\n')
+        self.file.close()
+
+
+class HocrOutputWriter:
+    def __init__(self, path, language):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">\n'
+            f'<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="{language}" lang="{language}">\n<head>\n'
+            '<meta http-equiv="Content-Type" content="text/html; charset=utf-8" />\n'
+            '<meta name="ocr-system" content="PDFTextifyBot" />\n'
+            '<meta name="ocr-capabilities" content="ocr_page ocr_carea ocr_par ocr_line ocrx_word" />\n'
+            '</head>\n<body>\n'
+        )
+
+    def _bbox(self, boxes):
+        return f"bbox {int(min(box[0] for box in boxes))} {int(min(box[1] for box in boxes))} {int(max(box[2] for box in boxes) + 0.5)} {int(max(box[3] for box in boxes) + 0.5)}"
+
+    def write_page(self, page_num, text, layout):
+        if layout is None:
+            self.file.write(f"<div class='ocr_page' id='page_{page_num}' title='ppageno {page_num - 1}'></div>\n")
+            return
+        self.file.write(f"<div class='ocr_page' id='page_{page_num}' title='bbox 0 0 {int(layout['width'])} {int(layout['height'])}; ppageno {page_num - 1}'>\n")
+        groups = {}
+        for word in layout['words']:
+            groups.setdefault(word['block'], {}).setdefault(word['par'], {}).setdefault(word['line'], []).append(word)
+        for block, paragraphs in groups.items():
+            block_words = [word for lines in paragraphs.values() for line_words in lines.values() for word in line_words]
+            self.file.write(f" <div class='ocr_carea' id='block_{page_num}_{block}' title='{self._bbox([word['bbox'] for word in block_words])}'>\n")
+            for par, lines in paragraphs.items():
+                par_words = [word for line_words in lines.values() for word in line_words]
+                self.file.write(f"  <p class='ocr_par' id='par_{page_num}_{block}_{par}' title='{self._bbox([word['bbox'] for word in par_words])}'>\n")
+                for line, line_words in lines.items():
+                    self.file.write(f"   <span class='ocr_line' id='line_{page_num}_{block}_{par}_{line}' title='{self._bbox([word['bbox'] for word in line_words])}'>")
+                    self.file.write(" ".join(
+                        f"<span class='ocrx_word' title='{self._bbox([word['bbox']])}; x_wconf {int(word['conf'])}'>{html.escape(word['text'])}</span>"
+                        for word in line_words
+                    ))
+                    self.file.write("</span>\n")
+                self.file.write("  </p>\n")
+            self.file.write(" </div>\n")
+        self.file.write("</div>\n")
+
+    def close(self):
+        self.file.write('</body>\n</html>\n')
+        self.file.close()
+
+
+class SearchablePdfWriter:
+    def __init__(self, source_path, path, language, font_path=None, chunk_pages=100):
+        self.path = path
+        self.chunk_pages = chunk_pages
+        if font_path:
+            self.font = fitz.Font(fontfile=font_path)
+        elif language == 'eng':
+            self.font = fitz.Font('helv')
+        else:
+            self.font = fitz.Font('cjk')
+        self.fontname = 'helv' if self.font.name == 'Helvetica' else 'ocrfont'
+        shutil.copyfile(source_path, path)
+        self.doc = fitz.open(path)
+        self.incremental = self.doc.can_save_incrementally()
+        self.pages_since_save = 0
+
+    def write_page(self, page_num, text, layout):
+        if layout is None or layout['source'] != 'ocr' or not layout['words']:
+            return
+        page = self.doc.load_page(page_num - 1)
+        if self.fontname != 'helv':
+            page.insert_font(fontname=self.fontname, fontbuffer=self.font.buffer)
+        derotation_matrix = page.derotation_matrix
+        shape = page.new_shape()
+        for word in layout['words']:
+            x0, y0, x1, y1 = word['bbox']
+            text_length = self.font.text_length(word['text'], fontsize=1)
+            if text_length <= 0 or x1 <= x0 or y1 <= y0:
+                continue
+            fontsize = min((x1 - x0) / text_length, (y1 - y0) * 1.5)
+            baseline = fitz.Point(x0, y1 - (y1 - y0) * BASELINE_RATIO) * derotation_matrix
+            shape.insert_text(baseline, word['text'], fontsize=fontsize, fontname=self.fontname, render_mode=3, rotate=page.rotation)
+        shape.commit()
+        self.pages_since_save += 1
+        if self.incremental and self.pages_since_save >= self.chunk_pages:
+            self._save_incremental()
+
+    def _save_incremental(self):
+        self.doc.save(self.path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP, deflate=True)
+        fitz.TOOLS.store_shrink(100)
+        self.pages_since_save = 0
+
+    def close(self):
+        if self.incremental:
+            if self.pages_since_save:
+                self._save_incremental()
+            self.doc.close()
+            return
+        temp_path = f"{self.path}.tmp"
+        self.doc.save(temp_path, garbage=1, deflate=True)
+        self.doc.close()
+        os.replace(temp_path, self.path)
@@ -0,0 +1,129 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from broker import create_broker
+from ocr import render_and_ocr_page
+
+WORKER_TASKS = {'render_and_ocr_page': render_and_ocr_page}
+DOCUMENTS_MAX_BYTES = 2048 * 1024 * 1024
+DOCUMENT_MIN_IDLE_SECONDS = 10 * 60
+
+
+def log_worker(message):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] [Worker {os.getpid()}] {message}")
+
+def load_worker_config(config_path):
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    tesseract_cmd = config.get('tesseract_path') or shutil.which('tesseract')
+    ocr_options = {
+        'backend': config.get('ocr_backend', 'auto'),
+        'tesseract_cmd': tesseract_cmd,
+        'tessdata_path': config.get('tessdata_path'),
+    }
+    return config, ocr_options
+
+def evict_local_documents(documents_dir, max_bytes):
+    entries = []
+    for name in os.listdir(documents_dir):
+        if not name.endswith('.pdf'):
+            continue
+        path = os.path.join(documents_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _mtime, size, _path in entries)
+    idle_before = time.time() - DOCUMENT_MIN_IDLE_SECONDS
+    for mtime, size, path in sorted(entries):
+        if total_size <= max_bytes or mtime > idle_before:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
+
+def ensure_local_document(broker, document_id, documents_dir, documents_max_bytes):
+    shared_path = broker.local_document_path(document_id)
+    if shared_path:
+        return shared_path
+    pdf_path = os.path.join(documents_dir, f"{document_id}.pdf")
+    try:
+        os.utime(pdf_path)
+        return pdf_path
+    except FileNotFoundError:
+        pass
+    temp_path = f"{pdf_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    broker.fetch_document(document_id, temp_path)
+    os.replace(temp_path, pdf_path)
+    evict_local_documents(documents_dir, documents_max_bytes)
+    return pdf_path
+
+def run_worker(broker, ocr_options, documents_dir, documents_max_bytes=DOCUMENTS_MAX_BYTES):
+    os.makedirs(documents_dir, exist_ok=True)
+    while True:
+        try:
+            task = broker.pop_task(timeout=5)
+        except Exception as e:
+            log_worker(f"Could not fetch a task from the broker: {e}")
+            time.sleep(5)
+            continue
+        if task is None:
+            continue
+
+        result = {'task_id': task['task_id'], 'page_num': task['page_index'] + 1, 'rotation': task['rotation']}
+        try:
+            task_fn = WORKER_TASKS[task['task']]
+            pdf_path = ensure_local_document(broker, task['document_id'], documents_dir, documents_max_bytes)
+            task_ocr_options = dict(ocr_options, capture_layout=task.get('capture_layout', False))
+            page_num, text, rotation_angle, timings, layout = task_fn(
+                pdf_path, task['page_index'], task['language'], task['rotation'], task['quality'], task_ocr_options
+            )
+            result.update({'page_num': page_num, 'text': text, 'rotation': rotation_angle, 'timings': timings, 'layout': layout})
+        except Exception as e:
+            log_worker(f"Task {task['task_id']} failed: {e}\n{traceback.format_exc()}")
+            result['error'] = str(e)
+        broker.push_result(task['reply_to'], result)
+
+def start_inprocess_workers(broker, ocr_options, documents_dir, num_workers):
+    threads = []
+    for worker_index in range(num_workers):
+        thread = threading.Thread(
+            target=run_worker, args=(broker, ocr_options, documents_dir), name=f"ocr-worker-{worker_index}", daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+    return threads
+
+def worker_process_main(config_path, documents_dir):
+    config, ocr_options = load_worker_config(config_path)
+    broker = create_broker(config.get('ocr_broker', 'redis'), config)
+    log_worker(f"Started (OCR backend: {ocr_options['backend']}).")
+    run_worker(broker, ocr_options, documents_dir, config.get('worker_documents_max_mb', 2048) * 1024 * 1024)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PDFTextifyBot OCR worker node.")
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--documents-dir', default=os.path.join('worker_storage', 'documents'))
+    args = parser.parse_args()
+
+    processes = []
+    for _ in range(max(1, args.processes)):
+        process = multiprocessing.Process(target=worker_process_main, args=(args.config, args.documents_dir))
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()